@@ -0,0 +1,241 @@
+"""Headless, seeded benchmark of the simulation over a range of population sizes.
+
+Run from the repository root:
+    python -m benchmarks.simulation --sizes 100,1000,10000 --output results.json
+    python -m benchmarks.simulation --compare results.json
+
+Every size runs in a fresh process, twice: once for timings and once under tracemalloc for memory,
+which would otherwise slow the timings down.
+"""
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Dict, List
+
+
+RESULT_PREFIX = "RESULT "
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def describe(values: List[float]) -> Dict[str, float]:
+    # Milliseconds.
+    return {"mean": sum(values) / len(values) * 1000,
+            "p50": percentile(values, 50) * 1000,
+            "p95": percentile(values, 95) * 1000,
+            "p99": percentile(values, 99) * 1000,
+            "max": max(values) * 1000}
+
+
+def get_state_hash(entity_manager) -> str:
+    # Changes whenever an optimisation changes what the simulation does, not only how fast.
+    from src.simulation.components import Position, Health, Hunger
+    data_filter = entity_manager.create_filter(required=(Position,), additional=(Health, Hunger))
+    state = []
+    for record in entity_manager.get_entities().filter(data_filter):
+        position = record.get_component(Position).value
+        values = [record.entity.get_id(), round(position.x, 6), round(position.y, 6)]
+        for component_type in (Health, Hunger):
+            component = record.get_component(component_type)
+            values.append(None if component is None else round(float(component.value), 6))
+        state.append(tuple(values))
+    state.sort()
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def run_single(args) -> dict:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    if args.memory:
+        import tracemalloc
+        tracemalloc.start()
+    from src.core.application import Application
+    from src.core.main_timer import Time
+    from src.ecs.world import World
+
+    Application(headless=True, workers=args.workers)
+    # Component types get their columns when first stored, but the import keeps the modes comparable.
+    import src.simulation.__all_components
+    if args.columnar or args.batched:
+        World.default_world = World.current_world = World(columnar=args.columnar, batched=args.batched,
+                                                          workers=args.workers)
+    world = World.default_world
+    columnar = world.get_manager().get_entities().is_columnar()
+    if (args.columnar or args.batched) and not columnar:
+        raise RuntimeError("Column storage is not available, is NumPy installed?")
+    if args.batched and not world.is_batched():
+        raise RuntimeError("The world does not run batched updates.")
+    world.create_all_systems(render=False)
+    from src.simulation.utils import create_named_creature, create_food, TEAM_COLORS
+    manager = world.get_manager()
+    random.seed(args.seed)
+    for num in range(args.single):
+        create_named_creature(manager, manager.create_entity(), "Bot" + str(num), num % len(TEAM_COLORS))
+    for _ in range(args.bushes):
+        create_food(manager, manager.create_entity())
+
+    delta_time = Time.get_fixed_delta_time()
+    for _ in range(args.warmup):
+        world.step(delta_time)
+    world.take_system_times()
+
+    # The mode that actually ran, not the one asked for.
+    result = {"creatures": args.single, "bushes": args.bushes,
+              "mode": {"columnar": columnar, "batched": world.is_batched(), "workers": args.workers}}
+    if args.memory:
+        import tracemalloc
+        gc.collect()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        for _ in range(args.steps):
+            world.step(delta_time)
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        result["memory"] = {"start_bytes": start_memory, "peak_bytes": peak_memory,
+                            "retained_bytes": current_memory - start_memory}
+        try:
+            import resource
+            # Kilobytes on Linux.
+            result["memory"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            pass
+        return result
+
+    collections = [i["collections"] for i in gc.get_stats()]
+    step_times = []
+    for _ in range(args.steps):
+        start_time = perf_counter()
+        world.step(delta_time)
+        step_times.append(perf_counter() - start_time)
+    # Garbage collections per generation: a rough measure of how many objects the steps allocate.
+    result["gc_collections"] = [i["collections"] - j for i, j in zip(gc.get_stats(), collections)]
+    result["entities"] = len(manager.get_entities())
+    result["state"] = get_state_hash(manager)
+    result["frame"] = describe(step_times)
+    result["systems"] = {name: {"calls": histogram.count,
+                                "mean": histogram.get_average() * 1000,
+                                "p95": histogram.get_percentile(95) * 1000,
+                                "max": histogram.max * 1000,
+                                "total": histogram.total * 1000}
+                         for name, histogram in world.take_system_times().items() if histogram.count}
+    return result
+
+
+def run_child(args, size: int, memory: bool) -> dict:
+    command = [sys.executable, "-m", "benchmarks.simulation", "--single", str(size),
+               "--bushes", str(int(size * args.bush_ratio)), "--steps", str(args.steps),
+               "--warmup", str(args.warmup), "--seed", str(args.seed), "--workers", str(args.workers)]
+    if args.columnar:
+        command.append("--columnar")
+    if args.batched:
+        command.append("--batched")
+    if memory:
+        command.append("--memory")
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    for line in reversed(output.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"No result in the output of {' '.join(command)}.")
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_result(result: dict) -> None:
+    frame = result["frame"]
+    mode = result["mode"]
+    print(f"{'batched' if mode['batched'] else 'columnar' if mode['columnar'] else 'scalar'}, "
+          f"{mode['workers']} workers: {result['creatures']} creatures, {result['bushes']} bushes -> {result['entities']} entities: "
+          f"step mean {'%.2f' % frame['mean']} ms, p95 {'%.2f' % frame['p95']} ms, "
+          f"p99 {'%.2f' % frame['p99']} ms, max {'%.2f' % frame['max']} ms")
+    if "memory" in result:
+        memory = result["memory"]
+        print(f"    memory peak {'%.1f' % (memory['peak_bytes'] / 2 ** 20)} MiB, "
+              f"retained {'%.1f' % (memory['retained_bytes'] / 2 ** 20)} MiB")
+    systems = sorted(result["systems"].items(), key=lambda i: -i[1]["total"])
+    for name, data in systems[:5]:
+        print(f"    {name}: mean {'%.3f' % data['mean']} ms, p95 {'%.3f' % data['p95']} ms")
+
+
+def compare(base: dict, current: dict) -> None:
+    print(f"Base {base.get('commit', '?')}, current {current.get('commit', '?')}.")
+    base_results = {i["creatures"]: i for i in base["results"]}
+    for result in current["results"]:
+        old = base_results.get(result["creatures"], None)
+        if old is None:
+            continue
+        ratio = result["frame"]["mean"] / old["frame"]["mean"]
+        line = f"{result['creatures']} creatures: step mean x{'%.2f' % ratio}, " \
+               f"p95 x{'%.2f' % (result['frame']['p95'] / old['frame']['p95'])}"
+        if old["state"] != result["state"]:
+            line += " (the simulation result changed)"
+        if old.get("mode", None) != result["mode"]:
+            line += " (ran in another mode)"
+        print(line)
+        for name, data in sorted(result["systems"].items(), key=lambda i: -i[1]["total"])[:5]:
+            old_data = old["systems"].get(name, None)
+            if old_data is not None and old_data["mean"]:
+                print(f"    {name}: x{'%.2f' % (data['mean'] / old_data['mean'])}")
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Headless benchmark of the simulation systems.")
+    parser.add_argument("--sizes", default="100,300,1000,3000,10000",
+                        help="comma separated numbers of creatures")
+    parser.add_argument("--bush-ratio", type=float, default=0.5, help="bushes per creature")
+    parser.add_argument("--steps", type=int, default=300, help="measured simulation steps")
+    parser.add_argument("--warmup", type=int, default=30, help="steps before the measurement")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="threads for independent systems; only systems that release the GIL (NumPy) gain")
+    parser.add_argument("--columnar", action="store_true")
+    parser.add_argument("--batched", action="store_true")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    # Internal: runs one size in this process.
+    parser.add_argument("--single", type=int)
+    parser.add_argument("--bushes", type=int, default=0)
+    parser.add_argument("--memory", action="store_true")
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(RESULT_PREFIX + json.dumps(run_single(args)))
+        return
+
+    report = {"commit": get_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "parameters": {"steps": args.steps, "warmup": args.warmup, "seed": args.seed,
+                             "bush_ratio": args.bush_ratio, "workers": args.workers,
+                             "columnar": args.columnar, "batched": args.batched},
+              "results": []}
+    for size in map(int, args.sizes.split(",")):
+        result = run_child(args, size, False)
+        if not args.no_memory:
+            result["memory"] = run_child(args, size, True)["memory"]
+        print_result(result)
+        report["results"].append(result)
+
+    if args.output:
+        with open(args.output, "w") as output_stream:
+            json.dump(report, output_stream, indent=2)
+    if args.compare:
+        with open(args.compare) as input_stream:
+            compare(json.load(input_stream), report)
+
+
+if __name__ == "__main__":
+    main()
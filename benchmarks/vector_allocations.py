@@ -0,0 +1,172 @@
+"""Vector micro-benchmarks and a per-system report of Vector allocations.
+
+Run from the repository root:
+    python -m benchmarks.vector_allocations             # timings and the allocation report
+    python -m benchmarks.vector_allocations --check     # fails when a system allocates more than the baseline
+    python -m benchmarks.vector_allocations --update    # writes the current counts as the new baseline
+
+Every Vector construction is counted and attributed to the system whose update is running. Work outside
+of system updates, such as buffered commands, counts as "other". tracemalloc reports the Vector memory
+the run retains.
+"""
+import json
+import os
+import random
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from timeit import Timer
+from typing import Dict
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "vector_allocations.json")
+OTHER = "other"
+
+
+def run_micro_benchmarks(number: int) -> Dict[str, float]:
+    from src.simulation.math import Vector
+    namespace = {"Vector": Vector, "a": Vector(3, 4), "b": Vector(1, 2), "s": 0.5}
+    statements = {
+        "a + b": "a + b",
+        "a - b": "a - b",
+        "a * s": "a * s",
+        "a / s": "a / s",
+        "a.normalized()": "a.normalized()",
+        "Vector.clone(a)": "Vector.clone(a)",
+        "(b - a).normalized() * s": "(b - a).normalized() * s",
+        "c += b": "c += b",
+    }
+    results = dict()
+    for name, statement in statements.items():
+        timer = Timer(statement, setup="c = Vector(0, 0)", globals=namespace)
+        # Nanoseconds per operation, best of three.
+        results[name] = min(timer.repeat(3, number)) / number * 1e9
+    return results
+
+
+class AllocationCounter:
+    __slots__ = ("current", "counts")
+
+    def __init__(self):
+        self.current = OTHER
+        self.counts: Dict[str, int] = dict()
+
+    def count(self) -> None:
+        self.counts[self.current] = self.counts.get(self.current, 0) + 1
+
+
+def instrument(counter: AllocationCounter) -> None:
+    # Patches classes before the world creates its systems, so the scheduled updates are the counting ones.
+    from src.ecs.systems import BaseSystem
+    from src.simulation.math import Vector
+    import src.simulation.__all_systems
+
+    initialize = Vector.__init__
+
+    def counting_init(self, x: float, y: float):
+        counter.count()
+        initialize(self, x, y)
+    Vector.__init__ = counting_init
+
+    def wrap(system_type: type, name: str) -> None:
+        function = system_type.__dict__[name]
+
+        def wrapper(self, delta_time: float):
+            counter.current = system_type.__name__
+            try:
+                return function(self, delta_time)
+            finally:
+                counter.current = OTHER
+        setattr(system_type, name, wrapper)
+
+    for system_type in BaseSystem.__subclasses__():
+        for name in ("on_update", "on_update_batch"):
+            if name in system_type.__dict__:
+                wrap(system_type, name)
+
+
+def count_allocations(creatures: int, bushes: int, steps: int, seed: int) -> dict:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from src.core.application import Application
+    from src.core.main_timer import Time
+    from src.ecs.world import World
+
+    counter = AllocationCounter()
+    Application(headless=True)
+    instrument(counter)
+    world = World.default_world
+    world.create_all_systems(render=False)
+    from src.simulation.utils import create_named_creature, create_food, TEAM_COLORS
+    manager = world.get_manager()
+    random.seed(seed)
+    for num in range(creatures):
+        create_named_creature(manager, manager.create_entity(), "Bot" + str(num), num % len(TEAM_COLORS))
+    for _ in range(bushes):
+        create_food(manager, manager.create_entity())
+
+    counter.counts.clear()
+    math_filter = tracemalloc.Filter(True, os.path.join("*", "simulation", "math.py"))
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot().filter_traces((math_filter,))
+    delta_time = Time.get_fixed_delta_time()
+    for _ in range(steps):
+        world.step(delta_time)
+    after = tracemalloc.take_snapshot().filter_traces((math_filter,))
+    tracemalloc.stop()
+    retained = sum(i.size_diff for i in after.compare_to(before, "filename"))
+
+    return {"creatures": creatures, "bushes": bushes, "steps": steps, "seed": seed,
+            "per_frame": {name: count / steps for name, count in sorted(counter.counts.items())},
+            "retained_bytes": retained}
+
+
+def check(report: dict, baseline: dict, tolerance: float) -> bool:
+    passed = True
+    for name, count in report["per_frame"].items():
+        limit = baseline["per_frame"].get(name, 0) * (1 + tolerance)
+        if count > limit:
+            print(f"{name}: {'%.1f' % count} Vector allocations per frame, the baseline allows {'%.1f' % limit}.")
+            passed = False
+    return passed
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Vector micro-benchmarks and allocation report.")
+    parser.add_argument("--creatures", type=int, default=300)
+    parser.add_argument("--bushes", type=int, default=150)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--number", type=int, default=200000, help="iterations of every micro-benchmark")
+    parser.add_argument("--check", action="store_true", help="compare with the baseline, exit with 1 on growth")
+    parser.add_argument("--update", action="store_true", help="save the counts as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed relative growth")
+    args = parser.parse_args()
+
+    if not args.check:
+        for name, time in run_micro_benchmarks(args.number).items():
+            print(f"{name}: {'%.0f' % time} ns")
+
+    report = count_allocations(args.creatures, args.bushes, args.steps, args.seed)
+    print(f"Vector allocations per frame, {args.creatures} creatures, {args.bushes} bushes, {args.steps} steps:")
+    for name, count in sorted(report["per_frame"].items(), key=lambda i: -i[1]):
+        print(f"    {name}: {'%.1f' % count}")
+    print(f"    total: {'%.1f' % sum(report['per_frame'].values())}")
+    print(f"Retained by math.py: {report['retained_bytes']} bytes.")
+
+    if args.update:
+        with open(BASELINE_PATH, "w") as output_stream:
+            json.dump(report, output_stream, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}.")
+    if args.check:
+        with open(BASELINE_PATH) as input_stream:
+            baseline = json.load(input_stream)
+        if any(baseline[key] != getattr(args, key) for key in ("creatures", "bushes", "steps", "seed")):
+            print("The baseline was recorded with other parameters.")
+            sys.exit(1)
+        if not check(report, baseline, args.tolerance):
+            sys.exit(1)
+        print("No system allocates more Vectors than the baseline.")
+
+
+if __name__ == "__main__":
+    main()
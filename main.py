@@ -1,3 +1,4 @@
+from argparse import ArgumentParser
 from src.core.application import Application
 import src.sql.data as db_session
 import src.vk_bot.client
@@ -8,8 +9,33 @@ BROADCAST_MESSAGES = 0
 
 if __name__ == "__main__":
 
+    parser = ArgumentParser()
+    # --headless - симуляция без окна и отрисовки, с максимальной скоростью. Для сервера без экрана.
+    parser.add_argument("--headless", action="store_true")
+    # --fast - ускоренный режим: столько шагов симуляции, сколько успевает процессор.
+    parser.add_argument("--fast", action="store_true")
+    # --workers N - число потоков, на которых параллельно работают независимые системы.
+    # Из-за GIL ускоряет только системы, которые отпускают его (векторные версии на NumPy, --batched).
+    # Обычные системы на чистом Python с несколькими потоками работают медленнее, поэтому по умолчанию 1.
+    parser.add_argument("--workers", type=int, default=1,
+                        help="потоки для независимых систем; помогают только системам, которые отпускают GIL "
+                             "(NumPy, --batched), по умолчанию 1")
+    # --batched - системы с векторной версией обновляют всех существ разом через NumPy. Нужен numpy.
+    parser.add_argument("--batched", action="store_true")
+    # --shards N - число процессов, между которыми делится карта. 0 - всё в одном процессе.
+    parser.add_argument("--shards", type=int, default=0)
+    # --profile - время работы систем и функций записывается в папку profiling, с трассой для chrome://tracing.
+    # Замедляет симуляцию, поэтому по умолчанию выключено.
+    parser.add_argument("--profile", action="store_true")
+    # --metrics-port N - порт, на котором отдаются метрики в формате Prometheus (http://127.0.0.1:N/metrics).
+    # 0 - без HTTP, метрики доступны только командой бота metrics.
+    parser.add_argument("--metrics-port", type=int, default=0)
+    args = parser.parse_args()
+
     # Инициализация приложения.
-    app = Application()
+    app = Application(headless=args.headless, workers=args.workers, shards=args.shards,
+                      metrics_port=args.metrics_port, batched=args.batched)
+    Application.set_fast_forward(args.fast)
 
     # Инициализация vk бота. С этого момента он отвечает на команды.
     src.vk_bot.client.init()
@@ -24,9 +50,10 @@ if __name__ == "__main__":
     # Должен запускаться после всех инициализаций.
     # profile=True - будет подсчитано время работы некоторых функций в папку profiling.
     # clear_log=False - при True все предыдушие файлы в папке profiling будут удалены.
-    app.run(profile=True, clear_log=False)
+    app.run(profile=args.profile, clear_log=False)
 
-    # Сохранение всех существ в базу данных.
+    # Во время работы мир сохраняется каждые SAVE_DELAY секунд в фоновом потоке.
+    # Сохранение всех существ в базу данных. Ждёт окончания фонового сохранения, если оно идёт.
     db_session.save_to_database()
     db_session.close()
 
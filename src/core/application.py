@@ -1,74 +1,111 @@
+import os
+from time import time
 import pygame
 from src.core.profiling import Profiler
+from src.core.metrics import Metrics
 from src.ecs.world import World
-from src.core.main_timer import Time
+from src.core.main_timer import Time, TARGET_FPS
 from src.core.input import Mouse
 
 
 WIDTH, HEIGHT = 800, 600
 BACKGROUND_COLOR = (102, 102, 51)
+SPEED_REPORT_DELAY = 10
 
 
 class Application:
-    __slots__ = ("__screen", "__is_running", "__clock", "__pr_commands", "__is_paused")
+    __slots__ = ("__screen", "__is_running", "__clock", "__pr_commands", "__is_paused", "__headless",
+                 "__speed", "__speed_sample", "__speed_report_time", "__shards", "__metrics_port")
     __instance: "Application" = None
 
-    def __init__(self):
+    def __init__(self, headless: bool = False, workers: int = 1, shards: int = 0, metrics_port: int = 0,
+                 batched: bool = False):
 
         if Application.__instance is None:
+            if headless:
+                os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
             pygame.init()
             Application.__instance = self
         else:
             raise Exception()
 
         self.__is_running = False
-        self.__screen: pygame.Surface = pygame.display.set_mode((WIDTH, HEIGHT), pygame.DOUBLEBUF)
+        self.__headless = headless
+        self.__screen: pygame.Surface = None
+        if not headless:
+            self.__screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.DOUBLEBUF)
         self.__clock = pygame.time.Clock()
         self.__pr_commands = []
         self.__is_paused = False
+        self.__speed = 0
+        self.__speed_sample = (time(), 0)
+        self.__speed_report_time = time()
+        self.__shards = shards
+        self.__metrics_port = metrics_port
 
-        World.default_world = World()
+        World.default_world = World(batched=batched, workers=workers)
 
     def run(self, profile=False, clear_log=False) -> None:
         from src.vk_bot.commands import BotMethods
+        from src.sql.data import AutoSave
         BotMethods.broadcast_message("Мы онлайн.")
 
-        Profiler.begin_profile_session()
-        World.default_world.create_all_systems()
+        if profile:
+            Profiler.begin_profile_session()
+        World.default_world.create_all_systems(render=not self.__headless)
+        coordinator = None
+        if self.__shards > 1:
+            from src.simulation.sharding import ShardCoordinator
+            coordinator = ShardCoordinator(self.__shards)
+            World.default_world.set_simulation(coordinator)
+        if self.__metrics_port:
+            Metrics.start_server(self.__metrics_port)
         self.__is_running = True
+        self.__update_frame_cap()
 
         Time.tick()
         Time.tick()
 
-        while self.__is_running:
-            events_found = False
-            for event in pygame.event.get():
-                events_found = True
-                Mouse.handle_event(event)
-                if event.type == pygame.QUIT:
-                    self.__is_running = False
-                    break
-            if not events_found:
-                Mouse.handle_event(None)
-
-            if self.__is_paused:
-                continue
-
-            self.__screen.fill(BACKGROUND_COLOR)
-            World.update_current()
-
-            Time.tick()
+        try:
+            while self.__is_running:
+                if not self.__headless:
+                    self.__handle_events()
 
-            pygame.display.flip()
-
-            for com in self.__pr_commands:
-                try:
-                    com()
-                except:
+                if self.__is_paused:
                     continue
-            self.__pr_commands.clear()
 
-            pygame.display.set_caption(str(int(Time.get_fps())))
+                if not self.__headless:
+                    self.__screen.fill(BACKGROUND_COLOR)
+                World.update_current()
+
+                Time.tick()
+                self.__measure_speed()
+                Metrics.update()
+                AutoSave.update()
+
+                if not self.__headless:
+                    pygame.display.flip()
+
+                for com in self.__pr_commands:
+                    try:
+                        com()
+                    except:
+                        continue
+                self.__pr_commands.clear()
+
+                if not self.__headless:
+                    caption = str(int(Time.get_fps()))
+                    if World.default_world.is_fast_forward():
+                        caption += f" x{'%.1f' % self.__speed}"
+                    pygame.display.set_caption(caption)
+        except KeyboardInterrupt:
+            self.__is_running = False
+
+        Metrics.stop_server()
+        if coordinator is not None:
+            # The world keeps the latest state of the shards, e.g. for saving.
+            coordinator.sync(World.default_world.get_manager(), collect=True)
+            coordinator.stop()
 
         if clear_log:
             Profiler.clear_log()
@@ -77,6 +114,43 @@ class Application:
 
         pygame.quit()
 
+    def __update_frame_cap(self) -> None:
+        if World.default_world.is_fast_forward():
+            Time.target_fps = 0
+        elif self.__headless:
+            # Nothing is drawn, so the loop only has to wake up as often as the simulation steps.
+            Time.target_fps = round(1 / Time.get_fixed_delta_time())
+        else:
+            Time.target_fps = TARGET_FPS
+
+    def __measure_speed(self) -> None:
+        now = time()
+        simulated_time = World.default_world.get_simulated_time()
+        last_time, last_simulated_time = self.__speed_sample
+        if now - last_time < 1:
+            return
+        self.__speed = (simulated_time - last_simulated_time) / (now - last_time)
+        self.__speed_sample = (now, simulated_time)
+        if self.__headless and World.default_world.is_fast_forward() \
+                and now - self.__speed_report_time >= SPEED_REPORT_DELAY:
+            self.__speed_report_time = now
+            print(f"Simulation speed: {'%.1f' % self.__speed} simulated seconds per second.")
+
+    def __handle_events(self) -> None:
+        events_found = False
+        for event in pygame.event.get():
+            events_found = True
+            Mouse.handle_event(event)
+            if event.type == pygame.QUIT:
+                self.__is_running = False
+                break
+        if not events_found:
+            Mouse.handle_event(None)
+
+    @staticmethod
+    def is_headless() -> bool:
+        return Application.__instance.__headless
+
     @staticmethod
     def get_render_surface():
         return Application.__instance.__screen
@@ -94,6 +168,19 @@ class Application:
         sleep(0.2)
         os._exit(0)
 
+    @staticmethod
+    def get_simulation_speed() -> float:
+        # Simulated seconds per wall-clock second over the last measured second.
+        return Application.__instance.__speed
+
+    @staticmethod
+    def set_fast_forward(value: bool) -> bool:
+        world = World.default_world
+        result = world.is_fast_forward() != value
+        world.set_fast_forward(value)
+        Application.__instance.__update_frame_cap()
+        return result
+
     @staticmethod
     def set_paused(value: bool) -> bool:
         result = Application.__instance.__is_paused != value
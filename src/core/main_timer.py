@@ -2,7 +2,12 @@ from pygame.time import Clock
 from time import time
 
 
-TARGET_FPS = 30
+TARGET_FPS = 60
+# The simulation always advances in steps of this length, whatever the frame rate.
+FIXED_DELTA_TIME = 1 / 30
+MAX_STEPS_PER_FRAME = 5
+# Wall time spent on simulation steps per displayed frame while fast-forwarding.
+FAST_FORWARD_FRAME_TIME = 0.1
 
 
 class Time:
@@ -11,18 +16,24 @@ class Time:
     __last_tick_time = 0
     __delta_time = 0
     time_scale = 1
+    # 0 leaves the loop uncapped.
+    target_fps = TARGET_FPS
 
     @staticmethod
     def tick() -> None:
         cur_time = time()
         Time.__delta_time = cur_time - Time.__last_tick_time
         Time.__last_tick_time = cur_time
-        Time.__clock.tick(TARGET_FPS)
+        Time.__clock.tick(Time.target_fps)
 
     @staticmethod
     def get_delta_time() -> float:
         return Time.__delta_time * Time.time_scale
 
+    @staticmethod
+    def get_fixed_delta_time() -> float:
+        return FIXED_DELTA_TIME
+
     @staticmethod
     def get_fps() -> float:
         return 1 / Time.__delta_time if Time.__delta_time != 0 else 1 / TARGET_FPS
@@ -0,0 +1,175 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import time
+from typing import Dict, List
+from src.core.main_timer import Time
+from src.core.profiling import Histogram
+from src.ecs.world import World
+
+
+METRICS_UPDATE_DELAY = 10
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class SeriesSnapshot:
+    # Quantiles over the last update period, count and sum over the whole run.
+    __slots__ = ("quantiles", "max", "count", "total")
+
+    def __init__(self, histogram: Histogram, count: int, total: float):
+        self.quantiles = [histogram.get_percentile(quantile * 100) for quantile in QUANTILES]
+        self.max = histogram.max
+        self.count = count
+        self.total = total
+
+
+class Metrics:
+    # Snapshot of the running simulation, collected on the main thread every METRICS_UPDATE_DELAY seconds
+    # and read by the HTTP endpoint and the bot from their own threads.
+    __slots__ = ()
+    __lock = Lock()
+    __snapshot: dict = None
+    __text = ""
+    __totals: Dict[str, List[float]] = {}
+    __bot_commands = 0
+    __last_update = 0
+    __server: ThreadingHTTPServer = None
+
+    @staticmethod
+    def count_bot_command() -> None:
+        with Metrics.__lock:
+            Metrics.__bot_commands += 1
+
+    @staticmethod
+    def update(force: bool = False) -> None:
+        now = time()
+        if not force and now - Metrics.__last_update < METRICS_UPDATE_DELAY:
+            return
+        Metrics.__last_update = now
+        from src.core.application import Application
+        from src.sql.data import EntryDeletionStack
+        world = World.default_world
+        manager = world.get_manager()
+
+        components = dict()
+        archetypes = 0
+        for archetype in manager.get_entities().get_archetypes():
+            if not archetype.records:
+                continue
+            archetypes += 1
+            for component_type in archetype.types:
+                components[component_type.__name__] = components.get(component_type.__name__, 0) \
+                    + len(archetype.records)
+
+        snapshot = {
+            "frame": Metrics.__series("frame", world.take_frame_times()),
+            "systems": {name: Metrics.__series(name, histogram)
+                        for name, histogram in world.take_system_times().items()},
+            "entities": len(manager.get_entities()),
+            "archetypes": archetypes,
+            "components": components,
+            "commands_pending": manager.get_command_count(),
+            "commands_flushed": manager.get_flushed_command_count(),
+            "deletions_pending": EntryDeletionStack.get_count(),
+            "bot_commands": Metrics.__bot_commands,
+            "steps": world.get_step_count(),
+            "fps": Time.get_fps(),
+            "speed": Application.get_simulation_speed(),
+        }
+        text = Metrics.__format(snapshot)
+        with Metrics.__lock:
+            Metrics.__snapshot = snapshot
+            Metrics.__text = text
+
+    @staticmethod
+    def __series(name: str, histogram: Histogram) -> SeriesSnapshot:
+        totals = Metrics.__totals.get(name, None)
+        if totals is None:
+            totals = Metrics.__totals[name] = [0, 0]
+        totals[0] += histogram.count
+        totals[1] += histogram.total
+        return SeriesSnapshot(histogram, totals[0], totals[1])
+
+    @staticmethod
+    def __format(snapshot: dict) -> str:
+        # Prometheus text exposition format.
+        lines = []
+
+        def add(name: str, kind: str, description: str, samples) -> None:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        def summary(series: SeriesSnapshot, labels: dict):
+            for quantile, value in zip(QUANTILES, series.quantiles):
+                yield dict(labels, quantile=str(quantile)), value
+
+        frame = snapshot["frame"]
+        systems = snapshot["systems"]
+        add("simulation_frame_seconds", "summary", "Time spent on one frame.",
+            list(summary(frame, {})))
+        lines.append(f"simulation_frame_seconds_sum {frame.total}")
+        lines.append(f"simulation_frame_seconds_count {frame.count}")
+        add("simulation_frame_seconds_max", "gauge", "Longest frame of the last period.", [({}, frame.max)])
+        add("simulation_system_seconds", "summary", "Time spent on one update of a system.",
+            [sample for name, series in systems.items() for sample in summary(series, {"system": name})])
+        for name, series in systems.items():
+            lines.append(f'simulation_system_seconds_sum{{system="{name}"}} {series.total}')
+            lines.append(f'simulation_system_seconds_count{{system="{name}"}} {series.count}')
+        add("simulation_system_seconds_max", "gauge", "Longest update of a system in the last period.",
+            [({"system": name}, series.max) for name, series in systems.items()])
+        add("simulation_entities", "gauge", "Number of entities.", [({}, snapshot["entities"])])
+        add("simulation_archetypes", "gauge", "Number of non-empty archetypes.", [({}, snapshot["archetypes"])])
+        add("simulation_components", "gauge", "Number of components of each type.",
+            [({"component": name}, count) for name, count in sorted(snapshot["components"].items())])
+        add("simulation_commands_pending", "gauge", "Commands waiting in the command buffer.",
+            [({}, snapshot["commands_pending"])])
+        add("simulation_commands_flushed", "gauge", "Commands executed by the last buffer flush.",
+            [({}, snapshot["commands_flushed"])])
+        add("simulation_deletions_pending", "gauge", "Components waiting to be deleted from the database.",
+            [({}, snapshot["deletions_pending"])])
+        add("simulation_bot_commands_total", "counter", "Bot commands received.", [({}, snapshot["bot_commands"])])
+        add("simulation_steps_total", "counter", "Simulation steps done.", [({}, snapshot["steps"])])
+        add("simulation_fps", "gauge", "Frames per second.", [({}, snapshot["fps"])])
+        add("simulation_speed", "gauge", "Simulated seconds per second.", [({}, snapshot["speed"])])
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def get_snapshot() -> dict:
+        with Metrics.__lock:
+            return Metrics.__snapshot
+
+    @staticmethod
+    def get_text() -> str:
+        with Metrics.__lock:
+            return Metrics.__text
+
+    @staticmethod
+    def start_server(port: int) -> None:
+        # Only listens on localhost: the endpoint is meant for a local scraper or an SSH tunnel.
+        Metrics.__server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+        Thread(target=Metrics.__server.serve_forever, daemon=True).start()
+        print(f"Metrics are served on http://127.0.0.1:{port}/metrics.")
+
+    @staticmethod
+    def stop_server() -> None:
+        if Metrics.__server is not None:
+            Metrics.__server.shutdown()
+            Metrics.__server = None
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = Metrics.get_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
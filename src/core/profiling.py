@@ -1,50 +1,192 @@
-from time import time
+import json
+from collections import deque
+from threading import Lock, current_thread, get_ident
+from time import perf_counter
 from datetime import datetime
-from os import remove, listdir
-from typing import Callable, Dict, Tuple
+from math import log2
+from os import remove, listdir, getpid
+from typing import Callable, Dict, List, Tuple
 from os import makedirs, path
 
 
+class Histogram:
+    # Log-scale buckets: percentiles are exact to about 9%, whatever the number of samples.
+    __slots__ = ("count", "total", "max", "__buckets")
+    BUCKETS_PER_OCTAVE = 8
+    MIN_VALUE = 1e-7
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.__buckets: Dict[int, int] = dict()
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        bucket = 0
+        if value > Histogram.MIN_VALUE:
+            bucket = int(log2(value / Histogram.MIN_VALUE) * Histogram.BUCKETS_PER_OCTAVE) + 1
+        self.__buckets[bucket] = self.__buckets.get(bucket, 0) + 1
+
+    def get_average(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def get_percentile(self, percent: float) -> float:
+        rank = self.count * percent / 100
+        passed = 0
+        for bucket in sorted(self.__buckets):
+            passed += self.__buckets[bucket]
+            if passed >= rank:
+                return min(Histogram.MIN_VALUE * 2 ** (bucket / Histogram.BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+
+class ProfileSpan:
+    # Times the enclosed block. Spans opened inside it show up nested in the trace.
+    __slots__ = ("name", "__start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.__start = 0
+
+    def __enter__(self):
+        self.__start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        Profiler.add_span(self.name, self.__start, perf_counter())
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
 class Profiler:
     __slots__ = ()
     __is_session_started = False
-    __session_data: Dict[str, Tuple[int, float]] = {}
+    __session_start = 0
+    __histograms: Dict[str, Histogram] = {}
+    # Chrome trace_event records of the spans, the way chrome://tracing and Perfetto open them.
+    __trace_events: deque = deque(maxlen=1)
+    __thread_names: Dict[int, str] = {}
+    __lock = Lock()
+    __null_span = NullSpan()
+    # (class, attribute, function) of every method decorated with @profiled.
+    __methods: List[Tuple[type, str, Callable]] = []
     PROFILING_RESULT_DIRECTORY = "profiling/"
+    # The trace is a ring buffer of the latest spans, about 350 bytes each. Older spans are dropped from it,
+    # but still count in the histograms.
+    MAX_TRACE_EVENTS = 50000
 
     @staticmethod
     def begin_profile_session() -> None:
+        Profiler.__histograms.clear()
+        Profiler.__trace_events = deque(maxlen=Profiler.MAX_TRACE_EVENTS)
+        Profiler.__thread_names.clear()
+        Profiler.__session_start = perf_counter()
         Profiler.__is_session_started = True
+        for owner, name, function in Profiler.__methods:
+            setattr(owner, name, Profiler.wrap(function))
 
     @staticmethod
     def end_profile_session() -> None:
         Profiler.__is_session_started = False
+        for owner, name, function in Profiler.__methods:
+            setattr(owner, name, function)
         if not path.exists(Profiler.PROFILING_RESULT_DIRECTORY):
             makedirs(Profiler.PROFILING_RESULT_DIRECTORY)
-        with open(Profiler.PROFILING_RESULT_DIRECTORY
-                  + f"profile_session_{str(datetime.now()).replace('.', '-').replace(':', '-')}", "w")\
-                as output_stream:
-            lines = []
-            for func_name, data in Profiler.__session_data.items():
-                lines.append(f"{func_name} average time: {'%.3f' % (data[1] * 1000 / data[0])} ms.\n")
-            output_stream.writelines(lines)
+        file_name = Profiler.PROFILING_RESULT_DIRECTORY \
+            + f"profile_session_{str(datetime.now()).replace('.', '-').replace(':', '-')}"
+        with open(file_name, "w") as output_stream:
+            output_stream.writelines(Profiler.get_report())
+        with open(file_name + ".json", "w") as output_stream:
+            json.dump(Profiler.get_trace(), output_stream)
 
     @staticmethod
     def is_session_started() -> bool:
         return Profiler.__is_session_started
 
+    @staticmethod
+    def get_report() -> List[str]:
+        lines = []
+        for name, histogram in sorted(Profiler.__histograms.items(), key=lambda i: -i[1].total):
+            lines.append(f"{name}: {histogram.count} calls, "
+                         f"average {'%.3f' % (histogram.get_average() * 1000)} ms, "
+                         f"p50 {'%.3f' % (histogram.get_percentile(50) * 1000)} ms, "
+                         f"p95 {'%.3f' % (histogram.get_percentile(95) * 1000)} ms, "
+                         f"p99 {'%.3f' % (histogram.get_percentile(99) * 1000)} ms, "
+                         f"max {'%.3f' % (histogram.max * 1000)} ms.\n")
+        return lines
+
+    @staticmethod
+    def get_trace() -> dict:
+        process_id = getpid()
+        names = [{"name": "thread_name", "ph": "M", "pid": process_id, "tid": thread_id, "args": {"name": name}}
+                 for thread_id, name in Profiler.__thread_names.items()]
+        return {"traceEvents": names + list(Profiler.__trace_events), "displayTimeUnit": "ms"}
+
+    @staticmethod
+    def get_histogram(name: str) -> Histogram:
+        return Profiler.__histograms.get(name, None)
+
+    @staticmethod
+    def register(owner: type, name: str, function: Callable) -> None:
+        Profiler.__methods.append((owner, name, function))
+        setattr(owner, name, Profiler.wrap(function) if Profiler.__is_session_started else function)
+
+    @staticmethod
+    def wrap(function: Callable) -> Callable:
+        # Methods are called far too often for the trace, they only get a histogram.
+        func_name = function.__qualname__
+
+        def wrapper(*args, **kwargs):
+            start_time = perf_counter()
+            result = function(*args, **kwargs)
+            Profiler.add_sample(func_name, perf_counter() - start_time)
+            return result
+        return wrapper
+
+    @staticmethod
+    def add_sample(name: str, elapsed_time: float) -> None:
+        with Profiler.__lock:
+            histogram = Profiler.__histograms.get(name, None)
+            if histogram is None:
+                histogram = Profiler.__histograms[name] = Histogram()
+            histogram.add(elapsed_time)
+
+    @staticmethod
+    def span(name: str):
+        if not Profiler.__is_session_started:
+            return Profiler.__null_span
+        return ProfileSpan(name)
+
+    @staticmethod
+    def add_span(name: str, start_time: float, end_time: float) -> None:
+        Profiler.add_sample(name, end_time - start_time)
+        thread_id = get_ident()
+        with Profiler.__lock:
+            if thread_id not in Profiler.__thread_names:
+                Profiler.__thread_names[thread_id] = current_thread().name
+            Profiler.__trace_events.append({
+                "name": name, "ph": "X", "pid": getpid(), "tid": thread_id,
+                "ts": (start_time - Profiler.__session_start) * 1000000,
+                "dur": (end_time - start_time) * 1000000})
+
     @staticmethod
     def profile(function: Callable, *args, **kwargs):
-        is_started = Profiler.is_session_started()
-        start_time = 0
-        if is_started:
-            start_time = time()
-        result = function(*args, **kwargs)
-        if is_started:
-            func_name = function.__qualname__
-            data = Profiler.__session_data.get(func_name, (0, 0))
-            elapsed_time = time() - start_time
-            Profiler.__session_data[func_name] = (data[0] + 1, data[1] + elapsed_time)
-        return result
+        if not Profiler.__is_session_started:
+            return function(*args, **kwargs)
+        with ProfileSpan(function.__qualname__):
+            return function(*args, **kwargs)
 
     @staticmethod
     def clear_log() -> None:
@@ -58,7 +200,17 @@ class Profiler:
                 print(f"Failed to delete {file_path}. Reason: {e}")
 
 
-def profiled(func: Callable):
-    def wrapper(*args, **kwargs):
-        return Profiler.profile(func, *args, **kwargs)
-    return wrapper
+class profiled:
+    # Method decorator. The class keeps the plain function while no session is started, so instrumented
+    # methods cost nothing then; Profiler swaps in timing wrappers for the duration of a session.
+    __slots__ = ("__function",)
+
+    def __init__(self, function: Callable):
+        self.__function = function
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        Profiler.register(owner, name, self.__function)
+
+    def __call__(self, *args, **kwargs):
+        # Only reached when used outside a class body.
+        return Profiler.profile(self.__function, *args, **kwargs)
@@ -0,0 +1,77 @@
+from typing import Dict, FrozenSet, Iterable, Optional, Type
+from src.ecs.component import BaseComponent
+from src.ecs.columns import ColumnField, START_CAPACITY
+
+
+ComponentTypes = FrozenSet[Type[BaseComponent]]
+
+
+class Archetype:
+    __slots__ = ("types", "records", "columns", "__add_edges", "__remove_edges")
+    types: ComponentTypes
+
+    def __init__(self, types: ComponentTypes, column_fields: Iterable[ColumnField] = ()):
+        self.types = types
+        self.records: list = []
+        # Only filled when the container uses column storage; rows match the order of records.
+        self.columns = {field: field.create_column(START_CAPACITY) for field in column_fields}
+        self.__add_edges: Dict[Type[BaseComponent], "Archetype"] = dict()
+        self.__remove_edges: Dict[Type[BaseComponent], "Archetype"] = dict()
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record) -> None:
+        record.archetype = self
+        record.row = len(self.records)
+        self.records.append(record)
+        if self.columns and record.row >= len(next(iter(self.columns.values()))):
+            self.__grow()
+
+    def pop(self, record) -> None:
+        self.__remove_row(record.row)
+
+    def move(self, record, target: "Archetype") -> None:
+        row = record.row
+        target.append(record)
+        for field, column in self.columns.items():
+            target_column = target.columns.get(field, None)
+            if target_column is not None:
+                target_column[record.row] = column[row]
+        self.__remove_row(row)
+
+    def get_column(self, component_type: Type[BaseComponent], name: str):
+        column = self.columns.get(component_type.__dict__[name], None)
+        if column is None:
+            raise KeyError(f"{component_type.__name__}.{name} is not stored in a column of this archetype.")
+        return column[:len(self.records)]
+
+    def __remove_row(self, row: int) -> None:
+        # Swap-remove: the last row takes the place of the removed one.
+        moved = self.records.pop()
+        last = len(self.records)
+        if row != last:
+            self.records[row] = moved
+            moved.row = row
+            for column in self.columns.values():
+                column[row] = column[last]
+
+    def __grow(self) -> None:
+        for field, column in self.columns.items():
+            grown = field.create_column(len(column) * 2)
+            grown[:len(column)] = column
+            self.columns[field] = grown
+
+    def get_add_edge(self, component_type: Type[BaseComponent]) -> Optional["Archetype"]:
+        return self.__add_edges.get(component_type, None)
+
+    def get_remove_edge(self, component_type: Type[BaseComponent]) -> Optional["Archetype"]:
+        return self.__remove_edges.get(component_type, None)
+
+    def set_edge(self, component_type: Type[BaseComponent], other: "Archetype") -> None:
+        if component_type in other.types:
+            self.__add_edges[component_type] = other
+            other.__remove_edges[component_type] = self
+        else:
+            self.__remove_edges[component_type] = other
+            other.__add_edges[component_type] = self
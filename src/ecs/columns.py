@@ -0,0 +1,131 @@
+from math import isnan
+from typing import Tuple, Type
+from src.ecs.component import BaseComponent
+from src.simulation.math import Vector
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+START_CAPACITY = 64
+
+
+def is_available() -> bool:
+    return np is not None
+
+
+class ColumnField:
+    # Replaces a component's slot once column storage is installed. Components attached to a columnar
+    # archetype read and write their archetype's NumPy row, detached ones fall back to the original slot.
+    __slots__ = ("component_type", "name", "width", "slot", "view_name")
+
+    def __init__(self, component_type: Type[BaseComponent], name: str, width: int, slot):
+        self.component_type = component_type
+        self.name = name
+        self.width = width
+        self.slot = slot
+        self.view_name = "_column_view_" + name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        record = instance._column_record
+        if record is None:
+            return self.slot.__get__(instance, owner)
+        if self.width == 1:
+            return float(record.archetype.columns[self][record.row])
+        if isnan(record.archetype.columns[self][record.row, 0]):
+            return None
+        view = getattr(instance, self.view_name, None)
+        if view is None:
+            view = ColumnVector(instance, self)
+            setattr(instance, self.view_name, view)
+        return view
+
+    def __set__(self, instance, value) -> None:
+        record = instance._column_record
+        if record is None:
+            self.slot.__set__(instance, value)
+        else:
+            self.write(record, value)
+
+    def write(self, record, value) -> None:
+        column = record.archetype.columns[self]
+        if value is None:
+            column[record.row] = np.nan
+        elif self.width == 1:
+            column[record.row] = value
+        else:
+            column[record.row] = (value.x, value.y)
+
+    def read_detached(self, instance) -> object:
+        value = self.__get__(instance, self.component_type)
+        return Vector.clone(value) if isinstance(value, Vector) else value
+
+    def create_column(self, capacity: int):
+        return np.zeros(capacity if self.width == 1 else (capacity, self.width), dtype=np.float64)
+
+
+class ColumnVector(Vector):
+    # Compatibility accessor: behaves like the Vector the component used to hold, but reads through
+    # to the column, so in-place operators such as `pos += offset` still update the component.
+    __slots__ = ("__component", "__field")
+
+    def __init__(self, component: BaseComponent, field: ColumnField):
+        self.__component = component
+        self.__field = field
+
+    def __get_coordinate(self, axis: int) -> float:
+        record = self.__component._column_record
+        if record is None:
+            return getattr(self.__field.slot.__get__(self.__component, None), "xy"[axis])
+        return float(record.archetype.columns[self.__field][record.row, axis])
+
+    def __set_coordinate(self, axis: int, value: float) -> None:
+        record = self.__component._column_record
+        if record is None:
+            setattr(self.__field.slot.__get__(self.__component, None), "xy"[axis], value)
+        else:
+            record.archetype.columns[self.__field][record.row, axis] = value
+
+    @property
+    def x(self) -> float:
+        return self.__get_coordinate(0)
+
+    @x.setter
+    def x(self, value: float) -> None:
+        self.__set_coordinate(0, value)
+
+    @property
+    def y(self) -> float:
+        return self.__get_coordinate(1)
+
+    @y.setter
+    def y(self, value: float) -> None:
+        self.__set_coordinate(1, value)
+
+
+def install(component_type: Type[BaseComponent]) -> Tuple[ColumnField, ...]:
+    fields = component_type.__dict__.get("__column_fields__", None)
+    if fields is None:
+        fields = tuple(ColumnField(component_type, name, width, component_type.__dict__[name])
+                       for name, width in component_type.__columns__.items())
+        for field in fields:
+            setattr(component_type, field.name, field)
+        component_type.__column_fields__ = fields
+    return fields
+
+
+def attach(component: BaseComponent, record) -> None:
+    for field in component.__column_fields__:
+        field.write(record, field.slot.__get__(component, None))
+    component._column_record = record
+
+
+def detach(component: BaseComponent) -> None:
+    values = [(field, field.read_detached(component)) for field in component.__column_fields__]
+    component._column_record = None
+    for field, value in values:
+        field.slot.__set__(component, value)
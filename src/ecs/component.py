@@ -1,11 +1,26 @@
 from src.sql.core import SqlAlchemyBase, sa
 from sqlalchemy.ext.declarative import declared_attr
+from typing import Dict
 
 
 class BaseComponent(SqlAlchemyBase):
     __abstract__ = True
     sql_entity_id = sa.Column(sa.Integer, primary_key=True, index=True, name="entity_id")
     __slots__ = ()
+    __type_count = 0
+    type_id: int = -1
+    # Numeric attributes that column storage may keep in NumPy arrays: {attribute: 1 for floats, 2 for vectors}.
+    __columns__: Dict[str, int] = {}
+    _column_record = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.type_id = BaseComponent.__type_count
+        BaseComponent.__type_count += 1
+
+    @staticmethod
+    def get_type_count() -> int:
+        return BaseComponent.__type_count
 
     @declared_attr
     def __tablename__(self) -> str:
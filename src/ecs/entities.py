@@ -1,25 +1,67 @@
-from typing import Dict, List, Type, TypeVar, Callable, Set, Generic
+from typing import Dict, List, Type, TypeVar, Callable, Set, Generic, Iterable, Iterator, Tuple, Optional
+from itertools import chain
+from threading import local
 from src.ecs.component import BaseComponent
+from src.ecs.archetypes import Archetype, ComponentTypes
+from src.ecs import columns
 from src.core.profiling import profiled
 
 
 class Entity:
     __current_id = 0
     __free_ids: Set[int] = set()
-    __slots__ = ("__id",)
+    __generations: List[int] = []
+    __slots__ = ("__id", "__generation")
+    HANDLE_ID_BITS = 20
 
     def __init__(self):
         if not Entity.__free_ids:
+            if Entity.__current_id >= 1 << Entity.HANDLE_ID_BITS:
+                raise EntityLimitError(f"Entity ids do not fit into {Entity.HANDLE_ID_BITS} bits of a handle.")
             self.__id = Entity.__current_id
             Entity.__current_id += 1
+            if self.__id == len(Entity.__generations):
+                Entity.__generations.append(0)
         else:
             self.__id = Entity.__free_ids.pop()
+        self.__generation = Entity.__generations[self.__id]
 
     def get_id(self) -> int:
         return self.__id
 
+    def get_generation(self) -> int:
+        return self.__generation
+
+    def get_handle(self) -> int:
+        return self.__generation << Entity.HANDLE_ID_BITS | self.__id
+
+    @staticmethod
+    def split_handle(handle: int) -> Tuple[int, int]:
+        return handle & ((1 << Entity.HANDLE_ID_BITS) - 1), handle >> Entity.HANDLE_ID_BITS
+
+    @staticmethod
+    def get_generations() -> List[int]:
+        # Generation that the next entity with each id gets, or has if it is alive.
+        return list(Entity.__generations)
+
+    @staticmethod
+    def restore_generations(generations: Dict[int, int]) -> None:
+        # Ids that have not been given out yet start at the saved generations, so handles from before
+        # a restart keep pointing to the same entities.
+        for entity_id, generation in generations.items():
+            if entity_id < Entity.__current_id:
+                continue
+            while len(Entity.__generations) <= entity_id:
+                Entity.__generations.append(0)
+            Entity.__generations[entity_id] = generation
+
+    def release(self) -> None:
+        if Entity.__generations[self.__id] == self.__generation:
+            Entity.__generations[self.__id] += 1
+            Entity.__free_ids.add(self.__id)
+
     def __eq__(self, other):
-        return self.__id == other.__id
+        return self.__id == other.__id and self.__generation == other.__generation
 
     def __ne__(self, other):
         return not self == other
@@ -38,139 +80,228 @@ class EntityExistsError(Exception):
     pass
 
 
+class EntityLimitError(Exception):
+    """Raised when entity ids run out of the bits reserved for them in a handle"""
+    pass
+
+
 TComponent = TypeVar("TComponent", bound=BaseComponent)
 
 
 class ComponentDataArray:
-    __slots__ = ("entity", "components", "__cache")
+    __slots__ = ("entity", "archetype", "row", "slots")
 
-    def __init__(self, entity: Entity, components: List[BaseComponent]):
+    def __init__(self, entity: Entity):
         self.entity = entity
-        self.components = {type(comp): comp for comp in components}
+        self.archetype: Archetype = None
+        self.row = 0
+        # Indexed by BaseComponent.type_id.
+        self.slots: List[BaseComponent] = [None] * BaseComponent.get_type_count()
+
+    @property
+    def components(self) -> Dict[Type[BaseComponent], BaseComponent]:
+        return {type(comp): comp for comp in self.slots if comp is not None}
 
     @profiled
     def get_component(self, component_type: Type[TComponent]) -> TComponent:
-        return self.components.get(component_type, None)
+        try:
+            return self.slots[component_type.type_id]
+        except IndexError:
+            return None
 
 
 class ComponentDataFilter:
-    __slots__ = ("required", "without", "additional")
+    __slots__ = ("required", "without", "additional", "__required_types", "__without_types")
 
     def __init__(self, required, without=(), additional=()):
         self.required = required
         self.without = without
         self.additional = additional
+        self.__required_types = frozenset(required)
+        self.__without_types = frozenset(without)
 
-    def filter(self, data: Dict[Entity, Set[BaseComponent]],
-               cache: Dict[Type[TComponent], Set[Entity]] = None) -> Set[ComponentDataArray]:
-        output = set()
-        if cache is None:
-            for entity, components in data.items():
-                temp = []
-                required_count = 0
-                for component in components:
-                    comp_type = type(component)
-                    if comp_type in self.without:
-                        temp.clear()
-                        break
-                    elif comp_type in self.required:
-                        required_count += 1
-                        temp.append(component)
-                    elif comp_type in self.additional:
-                        temp.append(component)
-                if required_count == len(self.required) and temp:
-                    output.add(ComponentDataArray(entity, temp))
-        else:
-            entities = set(data.keys())
-            for req in self.required:
-                entities &= cache[req]
-            for wout in self.without:
-                entities -= cache[wout]
-            output = set(
-                ComponentDataArray(
-                    entity,
-                    [component for component in data[entity]
-                     if type(component) in self.required or type(component) in self.additional])
-                for entity in entities)
+    def matches(self, archetype: Archetype) -> bool:
+        return self.__required_types <= archetype.types and self.__without_types.isdisjoint(archetype.types)
+
+    def filter(self, archetypes: Iterable[Archetype]) -> List[ComponentDataArray]:
+        output = []
+        for archetype in archetypes:
+            if archetype.records and self.matches(archetype):
+                output.extend(archetype.records)
         return output
 
 
-class EntityContainer:
-    __slots__ = ("__data", "__cache")
+class Query:
+    __slots__ = ("data_filter", "archetypes")
 
-    def __init__(self):
-        self.__data: Dict[Entity, Set[BaseComponent]] = dict()
-        self.__cache: Dict[Type[TComponent], Set[Entity]]\
-            = {comp_type: set() for comp_type in BaseComponent.__subclasses__()}
+    def __init__(self, data_filter: ComponentDataFilter, archetypes: Iterable[Archetype]):
+        self.data_filter = data_filter
+        self.archetypes: List[Archetype] = [archetype for archetype in archetypes if data_filter.matches(archetype)]
+
+    def on_archetype_created(self, archetype: Archetype) -> None:
+        if self.data_filter.matches(archetype):
+            self.archetypes.append(archetype)
+
+    def __iter__(self) -> Iterator[ComponentDataArray]:
+        # Rows are copied per archetype, so systems may add or remove components while iterating.
+        return chain.from_iterable([tuple(archetype.records) for archetype in self.archetypes if archetype.records])
+
+    def __len__(self):
+        return sum(len(archetype.records) for archetype in self.archetypes)
+
+
+class EntityContainer:
+    __slots__ = ("__archetypes", "__locations", "__ids", "__queries", "__columnar", "__column_fields",
+                 "__empty_archetype")
+
+    def __init__(self, columnar: bool = False):
+        if columnar and not columns.is_available():
+            print("NumPy is not installed, column storage is disabled.")
+            columnar = False
+        self.__columnar = columnar
+        self.__column_fields: Dict[Type[BaseComponent], Tuple[columns.ColumnField, ...]] = dict()
+        self.__archetypes: Dict[ComponentTypes, Archetype] = dict()
+        self.__locations: Dict[Entity, ComponentDataArray] = dict()
+        self.__ids: Dict[int, Entity] = dict()
+        self.__queries: Dict[ComponentDataFilter, Query] = dict()
+        self.__empty_archetype = self.__get_archetype(frozenset())
 
     def __getitem__(self, item):
-        return self.__data[item]
+        return list(self.__locations[item].components.values())
 
     def __len__(self):
-        return len(self.__data)
+        return len(self.__locations)
+
+    def __get_archetype(self, types: ComponentTypes) -> Archetype:
+        archetype = self.__archetypes.get(types, None)
+        if archetype is None:
+            archetype = Archetype(types, [field for comp_type in types
+                                          for field in self.__get_column_fields(comp_type)])
+            self.__archetypes[types] = archetype
+            for query in self.__queries.values():
+                query.on_archetype_created(archetype)
+        return archetype
+
+    def __get_column_fields(self, component_type: Type[BaseComponent]) -> Tuple[columns.ColumnField, ...]:
+        # Installed when a type is first stored, so types imported after the container was built get columns too.
+        fields = self.__column_fields.get(component_type, None)
+        if fields is None:
+            fields = columns.install(component_type) if self.__columnar and component_type.__columns__ else ()
+            self.__column_fields[component_type] = fields
+        return fields
+
+    def get_archetypes(self) -> Iterable[Archetype]:
+        return self.__archetypes.values()
+
+    def is_columnar(self) -> bool:
+        return self.__columnar
 
     def has_entity(self, entity: Entity) -> bool:
-        return entity in self.__data.keys()
+        return entity in self.__locations
 
     def add_entity(self, entity: Entity) -> None:
         if not self.has_entity(entity):
-            self.__data[entity] = set()
+            record = ComponentDataArray(entity)
+            self.__empty_archetype.append(record)
+            self.__locations[entity] = record
+            self.__ids[entity.get_id()] = entity
         else:
             raise EntityExistsError()
 
     @profiled
     def remove_entity(self, entity: Entity) -> None:
         if self.has_entity(entity):
-            to_remove = []
-            for data in self.__data[entity]:
-                to_remove.append(type(data))
-            for i in to_remove:
-                self.remove_entity_data(entity, i)
-            self.__data.pop(entity)
+            record = self.__locations.pop(entity)
+            self.__ids.pop(entity.get_id())
+            for component in record.slots:
+                if component is not None and component._column_record is record:
+                    columns.detach(component)
+            record.archetype.pop(record)
+            # Detached records keep answering get_component with None.
+            record.archetype = self.__empty_archetype
+            from src.sql.data import EntryDeletionStack
+            for num, component in enumerate(record.slots):
+                if component is not None:
+                    record.slots[num] = None
+                    EntryDeletionStack.add(component)
+                    component.on_remove()
         else:
             raise EntityNotFoundError()
 
     def add_entity_data(self, entity: Entity, data: BaseComponent) -> None:
         if self.has_entity(entity):
-            self.__data[entity].add(data)
-            self.__cache[type(data)].add(entity)
+            record = self.__locations[entity]
+            type_id = data.type_id
+            if type_id >= len(record.slots):
+                record.slots.extend([None] * (BaseComponent.get_type_count() - len(record.slots)))
+            replaced = record.slots[type_id]
+            if replaced is not None and replaced._column_record is record:
+                columns.detach(replaced)
+            record.slots[type_id] = data
+            if replaced is None:
+                self.__move(record, type(data), True)
+            if self.__get_column_fields(type(data)):
+                columns.attach(data, record)
         else:
             raise EntityNotFoundError()
 
     def remove_entity_data(self, entity: Entity, data_type: Type[BaseComponent]) -> None:
         if self.has_entity(entity):
-            to_remove = None
-            for data in self.__data[entity]:
-                if type(data) == data_type:
-                    to_remove = data
-                    break
-            if to_remove is not None:
-                self.__data[entity].discard(to_remove)
-                self.__cache[type(to_remove)].discard(entity)
-                from src.sql.data import EntryDeletionStack
-                EntryDeletionStack.add(to_remove)
-                to_remove.on_remove()
-
+            record = self.__locations[entity]
+            to_remove = record.get_component(data_type)
+            if to_remove is None:
+                return
+            if to_remove._column_record is record:
+                columns.detach(to_remove)
+            record.slots[data_type.type_id] = None
+            self.__move(record, data_type, False)
+
+            from src.sql.data import EntryDeletionStack
+            EntryDeletionStack.add(to_remove)
+            to_remove.on_remove()
         else:
             raise EntityNotFoundError()
 
+    def __move(self, record: ComponentDataArray, data_type: Type[BaseComponent], added: bool) -> None:
+        archetype = record.archetype
+        if added:
+            target = archetype.get_add_edge(data_type)
+        else:
+            target = archetype.get_remove_edge(data_type)
+        if target is None:
+            target = self.__get_archetype(archetype.types | {data_type} if added else archetype.types - {data_type})
+            archetype.set_edge(data_type, target)
+        archetype.move(record, target)
+
     @profiled
-    def filter(self, data_filter: ComponentDataFilter) -> Set[ComponentDataArray]:
-        return data_filter.filter(self.__data, self.__cache)
+    def filter(self, data_filter: ComponentDataFilter) -> List[ComponentDataArray]:
+        return data_filter.filter(self.__archetypes.values())
+
+    def query(self, data_filter: ComponentDataFilter) -> Query:
+        query = self.__queries.get(data_filter, None)
+        if query is None:
+            query = Query(data_filter, self.__archetypes.values())
+            self.__queries[data_filter] = query
+        return query
 
     @profiled
     def get_component(self, entity: Entity, component_type: Type[TComponent]) -> TComponent:
-        if self.has_entity(entity):
-            for comp in self.__data[entity]:
-                if type(comp) == component_type:
-                    return comp
+        record = self.__locations.get(entity, None)
+        if record is not None:
+            return record.get_component(component_type)
 
-    @profiled
     def get_entity(self, entity_id: int) -> Entity:
-        for entity in self.__data.keys():
-            if entity.get_id() == entity_id:
-                return entity
-        raise EntityNotFoundError()
+        entity = self.__ids.get(entity_id, None)
+        if entity is None:
+            raise EntityNotFoundError()
+        return entity
+
+    def get_entity_by_handle(self, handle: int) -> Entity:
+        entity_id, generation = Entity.split_handle(handle)
+        entity = self.__ids.get(entity_id, None)
+        if entity is None or entity.get_generation() != generation:
+            raise EntityNotFoundError()
+        return entity
 
 
 class BufferedCommand:
@@ -195,6 +326,13 @@ class CommandBuffer:
     def add_command(self, command: Callable, *args, **kwargs) -> None:
         self.__commands.append(BufferedCommand(command, *args, **kwargs))
 
+    def __len__(self):
+        return len(self.__commands)
+
+    def move_to(self, other: "CommandBuffer") -> None:
+        other.__commands.extend(self.__commands)
+        self.__commands.clear()
+
     def execute_commands(self) -> None:
         for command in self.__commands:
             try:
@@ -206,13 +344,15 @@ class CommandBuffer:
 
 
 class EntityManager:
-    __slots__ = ("__container", "__command_buffer")
+    __slots__ = ("__container", "__command_buffer", "__local", "__flushed")
     __container: EntityContainer
     __command_buffer: CommandBuffer
 
-    def __init__(self):
-        self.__container = EntityContainer()
+    def __init__(self, columnar: bool = False):
+        self.__container = EntityContainer(columnar)
         self.__command_buffer = CommandBuffer()
+        self.__local = local()
+        self.__flushed = 0
 
     def create_entity(self) -> Entity:
         entity = Entity()
@@ -221,6 +361,7 @@ class EntityManager:
 
     def kill_entity(self, entity: Entity) -> None:
         self.__container.remove_entity(entity)
+        entity.release()
 
     def add_component(self, entity: Entity, component: BaseComponent) -> None:
         self.__container.add_entity_data(entity, component)
@@ -235,11 +376,27 @@ class EntityManager:
         return self.__container
 
     def add_command(self, command: Callable, *args, **kwargs) -> None:
-        self.__command_buffer.add_command(command, *args, **kwargs)
+        buffer = getattr(self.__local, "buffer", None)
+        (buffer if buffer is not None else self.__command_buffer).add_command(command, *args, **kwargs)
+
+    def set_thread_buffer(self, buffer: Optional[CommandBuffer]) -> None:
+        # Commands added from the calling thread go to this buffer until it is reset with None.
+        self.__local.buffer = buffer
+
+    def append_buffer(self, buffer: CommandBuffer) -> None:
+        buffer.move_to(self.__command_buffer)
 
     def release_buffer(self) -> None:
+        self.__flushed = len(self.__command_buffer)
         self.__command_buffer.execute_commands()
 
+    def get_command_count(self) -> int:
+        return len(self.__command_buffer)
+
+    def get_flushed_command_count(self) -> int:
+        # Number of commands executed by the last release_buffer.
+        return self.__flushed
+
     @staticmethod
     def create_filter(required=(), without=(), additional=()) -> ComponentDataFilter:
         return ComponentDataFilter(required, without, additional)
@@ -247,5 +404,8 @@ class EntityManager:
     def get_entity(self, entity_id: int) -> Entity:
         return self.__container.get_entity(entity_id)
 
+    def get_entity_by_handle(self, handle: int) -> Entity:
+        return self.__container.get_entity_by_handle(handle)
+
     def has_entity(self, entity: Entity) -> bool:
         return self.__container.has_entity(entity)
\ No newline at end of file
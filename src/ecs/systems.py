@@ -1,8 +1,13 @@
 from abc import ABC, abstractmethod
+from typing import Tuple
 from src.ecs.entities import EntityManager
 from src.ecs.entities import ComponentDataFilter
-from src.ecs.entities import ComponentDataArray
-from typing import Set
+from src.ecs.entities import Query
+
+
+class SharedRandom:
+    """Stands for the global random generator in read and write sets of systems that draw from it"""
+    pass
 
 
 class BaseSystem(ABC):
@@ -10,6 +15,17 @@ class BaseSystem(ABC):
     is_enabled: bool
     entity_manager: EntityManager
     __update_order__: int = 0
+    # Render-only systems are not created when the application runs without a display.
+    __render__: bool = False
+    # Seconds between two updates of a simulation system, 0 runs it every step. Without a declared phase
+    # World picks one so that interval systems land on different steps where possible.
+    __update_interval__: float = 0
+    __update_phase__: float = None
+    # Component types the system reads and writes. Systems that declare both may run on worker threads next
+    # to systems they do not conflict with, and must then change entity structure only through add_command.
+    # Undeclared systems always run alone.
+    __reads__: Tuple[type, ...] = None
+    __writes__: Tuple[type, ...] = None
 
     def on_create(self) -> None:
         pass
@@ -18,8 +34,16 @@ class BaseSystem(ABC):
     def on_update(self, delta_time: float) -> None:
         raise NotImplementedError()
 
-    def query(self, data_filter: ComponentDataFilter) -> Set[ComponentDataArray]:
-        return self.entity_manager.get_entities().filter(data_filter)
+    def on_update_batch(self, delta_time: float) -> None:
+        # Vectorized variant used by batched worlds. Systems without one run on_update there as well.
+        self.on_update(delta_time)
+
+    @classmethod
+    def has_batch_update(cls) -> bool:
+        return cls.on_update_batch is not BaseSystem.on_update_batch
+
+    def query(self, data_filter: ComponentDataFilter) -> Query:
+        return self.entity_manager.get_entities().query(data_filter)
 
     def __lt__(self, other: "BaseSystem"):
         return self.__update_order__ < other.__update_order__
@@ -1,8 +1,12 @@
-from src.ecs.entities import EntityManager
+from concurrent.futures import ThreadPoolExecutor
+from src.ecs.component import BaseComponent
+from src.ecs.entities import Entity, EntityManager, CommandBuffer
 from src.ecs.systems import BaseSystem
-from typing import List, Type, TypeVar
-from src.core.profiling import profiled
-from src.core.main_timer import Time
+from math import gcd
+from time import perf_counter
+from typing import Dict, List, Tuple, Type, TypeVar
+from src.core.profiling import Histogram, Profiler, profiled
+from src.core.main_timer import Time, MAX_STEPS_PER_FRAME, FAST_FORWARD_FRAME_TIME
 
 
 class SystemNotExistsError(Exception):
@@ -15,19 +19,58 @@ class SystemExistsError(Exception):
     pass
 
 
+class ScheduledSystem:
+    __slots__ = ("system", "interval", "phase", "update", "batch_update", "reads", "writes", "times")
+
+    def __init__(self, system: BaseSystem, interval: int, phase: int):
+        self.system = system
+        self.interval = interval
+        self.phase = phase
+        self.reads = None
+        self.writes = None
+        if system.__reads__ is not None and system.__writes__ is not None:
+            self.writes = frozenset(system.__writes__)
+            self.reads = frozenset(system.__reads__) | self.writes
+        self.times = Histogram()
+        self.update = system.on_update
+        self.batch_update = system.on_update_batch if system.has_batch_update() else self.update
+
+    def is_due(self, step: int) -> bool:
+        return self.interval == 1 or (step - self.phase) % self.interval == 0
+
+    def conflicts(self, other: "ScheduledSystem") -> bool:
+        if self.writes is None or other.writes is None:
+            return True
+        return not self.writes.isdisjoint(other.reads) or not other.writes.isdisjoint(self.reads)
+
+
 class World:
     default_world: "World" = None
     current_world: "World" = None
     __current_id = 0
-    __slots__ = ("__id", "__entity_manager", "__systems")
+    __slots__ = ("__id", "__entity_manager", "__systems", "__schedule", "__batched", "__accumulator",
+                 "__step_count", "__fast_forward", "__workers", "__stages", "__simulation",
+                 "__frame_times")
     TSystem = TypeVar("TSystem", bound=BaseSystem)
 
-    def __init__(self):
+    def __init__(self, columnar: bool = False, batched: bool = False, workers: int = 1):
         self.__id = World.__current_id
         World.__current_id += 1
 
-        self.__entity_manager = EntityManager()
+        # Batched systems work on column storage, so they imply it.
+        self.__entity_manager = EntityManager(columnar or batched)
         self.__systems: List[BaseSystem] = []
+        self.__schedule: List[ScheduledSystem] = []
+        self.__batched = batched and self.__entity_manager.get_entities().is_columnar()
+        self.__accumulator = 0
+        self.__step_count = 0
+        self.__fast_forward = False
+        # Threads only pay off for systems that release the GIL, such as NumPy batch updates; pure Python
+        # systems run slower on several of them, so the default is 1.
+        self.__workers = ThreadPoolExecutor(workers) if workers > 1 else None
+        self.__stages: Dict[Tuple[int, ...], List[List[ScheduledSystem]]] = dict()
+        self.__simulation = None
+        self.__frame_times = Histogram()
 
         if World.current_world is None:
             World.current_world = self
@@ -56,8 +99,24 @@ class World:
         self.__systems.append(system)
         system.on_create()
         self.__systems.sort()
+        self.__schedule_system(system)
         return system
 
+    def __schedule_system(self, system: BaseSystem) -> None:
+        fixed_delta_time = Time.get_fixed_delta_time()
+        interval = max(1, round(system.__update_interval__ / fixed_delta_time))
+        if system.__update_phase__ is not None:
+            phase = round(system.__update_phase__ / fixed_delta_time) % interval
+        else:
+            # Two systems meet on some step exactly when their phases are equal modulo the gcd of their
+            # intervals, so take the phase that meets the fewest already scheduled interval systems.
+            others = [i for i in self.__schedule if i.interval > 1]
+            phase = min(range(interval),
+                        key=lambda p: sum((p - i.phase) % gcd(interval, i.interval) == 0 for i in others))
+        self.__schedule.append(ScheduledSystem(system, interval, phase))
+        self.__schedule.sort(key=lambda i: i.system)
+        self.__stages.clear()
+
     @profiled
     def get_or_create_system(self, system_type: Type[TSystem]) -> TSystem:
         try:
@@ -67,26 +126,176 @@ class World:
 
     @profiled
     def remove_system(self, system_type: Type[TSystem]) -> None:
-        self.__systems.remove(self.get_system(system_type))
+        system = self.get_system(system_type)
+        self.__systems.remove(system)
+        self.__schedule = [i for i in self.__schedule if i.system is not system]
+        self.__stages.clear()
 
     def set_system_state(self, system_type: Type[TSystem], enabled: bool) -> None:
         self.get_system(system_type).is_enabled = enabled
 
+    def is_batched(self) -> bool:
+        return self.__batched
+
+    def set_batched(self, value: bool) -> None:
+        self.__batched = value and self.__entity_manager.get_entities().is_columnar()
+
+    def is_fast_forward(self) -> bool:
+        return self.__fast_forward
+
+    def set_fast_forward(self, value: bool) -> None:
+        self.__fast_forward = value
+
+    def set_simulation(self, simulation) -> None:
+        # Hands the simulation steps over to an object with step(delta_time), sync(entity_manager) and
+        # edit(entity, component), e.g. a sharded simulation in other processes. The world then only mirrors
+        # its entities and renders.
+        self.__simulation = simulation
+
+    def edit_component(self, entity: Entity, component: BaseComponent) -> None:
+        # Must follow a component added or changed outside of the systems, e.g. by a bot command,
+        # so that a simulation running elsewhere gets it too.
+        if self.__simulation is not None:
+            self.__simulation.edit(entity, component)
+
+    def get_step_count(self) -> int:
+        return self.__step_count
+
+    def get_simulated_time(self) -> float:
+        return self.__step_count * Time.get_fixed_delta_time()
+
+    def get_interpolation(self) -> float:
+        # How far the frame is between the last simulation step and the next one, from 0 to 1.
+        return self.__accumulator / Time.get_fixed_delta_time()
+
     def update(self) -> None:
+        # One frame: the root span of the profiler's trace.
+        start_time = perf_counter()
+        with Profiler.span("World.update"):
+            self.__update()
+        self.__frame_times.add(perf_counter() - start_time)
+
+    def take_frame_times(self) -> Histogram:
+        # Frame times since the previous call.
+        result = self.__frame_times
+        self.__frame_times = Histogram()
+        return result
+
+    def take_system_times(self) -> Dict[str, Histogram]:
+        # Update times of every system since the previous call.
+        result = dict()
+        for scheduled in self.__schedule:
+            result[type(scheduled.system).__name__] = scheduled.times
+            scheduled.times = Histogram()
+        return result
+
+    def __update(self) -> None:
+        fixed_delta_time = Time.get_fixed_delta_time()
+        step_count = self.__step_count
+        if self.__fast_forward:
+            # Steps as many times as fit into the frame's time budget, regardless of the time that passed.
+            self.__accumulator = 0
+            deadline = perf_counter() + FAST_FORWARD_FRAME_TIME
+            while perf_counter() < deadline:
+                self.step(fixed_delta_time)
+        else:
+            self.__accumulator += Time.get_delta_time()
+        steps = 0
+        while self.__accumulator >= fixed_delta_time:
+            if steps == MAX_STEPS_PER_FRAME:
+                # Too far behind to catch up: drop the backlog instead of stalling every next frame.
+                self.__accumulator = 0
+                break
+            self.step(fixed_delta_time)
+            self.__accumulator -= fixed_delta_time
+            steps += 1
+        if self.__simulation is not None and self.__step_count != step_count:
+            self.__simulation.sync(self.__entity_manager)
+
         delta_time = Time.get_delta_time()
-        for system in self.__systems:
-            if system.is_enabled:
-                profiled(system.on_update)(delta_time)
+        for scheduled in self.__schedule:
+            if scheduled.system.__render__ and scheduled.system.is_enabled:
+                start_time = perf_counter()
+                Profiler.profile(scheduled.update, delta_time)
+                scheduled.times.add(perf_counter() - start_time)
         self.__entity_manager.release_buffer()
 
+    def step(self, delta_time: float) -> None:
+        with Profiler.span("World.step"):
+            self.__step(delta_time)
+
+    def __step(self, delta_time: float) -> None:
+        if self.__simulation is not None:
+            Profiler.profile(self.__simulation.step, delta_time)
+            self.__entity_manager.release_buffer()
+            self.__step_count += 1
+            return
+        step = self.__step_count
+        due = tuple(num for num, scheduled in enumerate(self.__schedule)
+                    if not scheduled.system.__render__ and scheduled.system.is_enabled and scheduled.is_due(step))
+        stages = self.__stages.get(due, None)
+        if stages is None:
+            stages = self.__stages[due] = self.__build_stages([self.__schedule[num] for num in due])
+        for stage in stages:
+            self.__run_stage(stage, delta_time)
+        Profiler.profile(self.__entity_manager.release_buffer)
+        self.__step_count += 1
+
+    @staticmethod
+    def __build_stages(systems: List[ScheduledSystem]) -> List[List[ScheduledSystem]]:
+        # Every system goes to the stage after the last earlier system it conflicts with. Conflicting systems
+        # keep their update order and systems within one stage touch disjoint components.
+        stages = []
+        levels = []
+        for num, scheduled in enumerate(systems):
+            level = 0
+            for other, other_level in zip(systems[:num], levels):
+                if other_level >= level and scheduled.conflicts(other):
+                    level = other_level + 1
+            levels.append(level)
+            if level == len(stages):
+                stages.append([])
+            stages[level].append(scheduled)
+        return stages
+
+    def __run_stage(self, stage: List[ScheduledSystem], delta_time: float) -> None:
+        if self.__workers is None or len(stage) < 2:
+            for scheduled in stage:
+                self.__run_system(scheduled, delta_time)
+            return
+        buffers = [CommandBuffer() for _ in stage]
+        tasks = [self.__workers.submit(self.__run_buffered, scheduled, buffer, delta_time)
+                 for scheduled, buffer in zip(stage, buffers)]
+        for task in tasks:
+            task.result()
+        # Commands are queued in update order, whichever system finished first.
+        for buffer in buffers:
+            self.__entity_manager.append_buffer(buffer)
+
+    def __run_buffered(self, scheduled: ScheduledSystem, buffer: CommandBuffer, delta_time: float) -> None:
+        self.__entity_manager.set_thread_buffer(buffer)
+        try:
+            self.__run_system(scheduled, delta_time)
+        finally:
+            self.__entity_manager.set_thread_buffer(None)
+
+    def __run_system(self, scheduled: ScheduledSystem, delta_time: float) -> None:
+        # Interval systems get the time passed since their previous update.
+        start_time = perf_counter()
+        Profiler.profile(scheduled.batch_update if self.__batched else scheduled.update,
+                         delta_time * scheduled.interval)
+        scheduled.times.add(perf_counter() - start_time)
+
     @staticmethod
     def update_current() -> None:
         World.current_world.update()
 
-    def create_all_systems(self) -> None:
+    def create_all_systems(self, render: bool = True) -> None:
         count = 0
         import src.simulation.__all_systems
         for system_type in BaseSystem.__subclasses__():
+            if system_type.__render__ and not render:
+                continue
             try:
                 self.create_system(system_type)
                 count += 1
@@ -1,39 +1,85 @@
+from functools import partial
+from typing import Callable, Optional
 from src.ecs.component import BaseComponent
 import sqlalchemy as sa
 from src.ecs.entities import EntityManager
 from src.simulation.math import Vector
-from pygame import image, sprite
+from pygame import image
+from pygame.sprite import Sprite
+
+
+def load_sprite(data, width: int, height: int) -> Sprite:
+    result = Sprite()
+    result.image = image.fromstring(data, (width, height), "RGBA")
+    result.rect = result.image.get_rect()
+    return result
 
 
 class RenderSprite(BaseComponent):
-    __slots__ = ("sprite",)
+    # The surface is built on first access, so a simulation without a display never creates one.
+    __slots__ = ("__sprite", "__factory", "__saved")
     sql_image = sa.Column(sa.String, name="image")
     sql_width = sa.Column(sa.Integer, name="width")
     sql_height = sa.Column(sa.Integer, name="height")
 
     def __init__(self):
-        self.sprite = None
+        self.__sprite = None
+        self.__factory = None
+        self.__saved = None
+
+    @property
+    def sprite(self) -> Sprite:
+        if self.__sprite is None and self.__factory is not None:
+            self.__sprite = self.__factory()
+            self.__factory = None
+        return self.__sprite
+
+    @sprite.setter
+    def sprite(self, value: Sprite) -> None:
+        self.__sprite = value
+        self.__factory = None
+        self.__saved = None
+
+    def set_factory(self, factory: Callable[[], Sprite]) -> None:
+        self.__sprite = None
+        self.__factory = factory
+        self.__saved = None
+
+    def get_factory(self) -> Optional[Callable[[], Sprite]]:
+        # A factory that recreates the sprite elsewhere, even once the surface has been built.
+        if self.__factory is None and self.__sprite is not None:
+            rect = self.__sprite.image.get_rect()
+            return partial(load_sprite, image.tostring(self.__sprite.image, "RGBA"), rect.w, rect.h)
+        return self.__factory
 
     def to_database(self) -> None:
-        bin_data = image.tostring(self.sprite.image, "RGBA")
-        self.sql_image = bin_data
-        rect = self.sprite.image.get_rect()
-        self.sql_width = rect.w
-        self.sql_height = rect.h
+        # Saving must not build the sprite: a loaded one is saved from its data, a drawn one is rendered
+        # once and its data is kept for the next saves.
+        factory = self.__factory
+        if self.__sprite is None and isinstance(factory, partial) and factory.func is load_sprite:
+            self.sql_image, self.sql_width, self.sql_height = factory.args
+            return
+        if self.__saved is None:
+            if self.__sprite is None and factory is None:
+                return
+            surface = (self.__sprite if self.__sprite is not None else factory()).image
+            rect = surface.get_rect()
+            self.__saved = (image.tostring(surface, "RGBA"), rect.w, rect.h)
+        self.sql_image, self.sql_width, self.sql_height = self.__saved
 
     def from_database(self, entity_manager) -> None:
-        self.sprite = sprite.Sprite()
-        self.sprite.image = image.fromstring(self.sql_image, (self.sql_width, self.sql_height), "RGBA")
-        self.sprite.rect = self.sprite.image.get_rect()
+        self.set_factory(partial(load_sprite, self.sql_image, self.sql_width, self.sql_height))
 
     def on_remove(self) -> None:
-        self.sprite.kill()
+        if self.__sprite is not None:
+            self.__sprite.kill()
 
 
 class Position(BaseComponent):
     sql_x = sa.Column(sa.Float, name="x")
     sql_y = sa.Column(sa.Float, name="y")
     __slots__ = ("value",)
+    __columns__ = {"value": 2}
 
     def __init__(self):
         self.value = None
@@ -103,6 +149,7 @@ class UserId(BaseComponent):
 
 class MoveSpeed(BaseComponent):
     __slots__ = ("value",)
+    __columns__ = {"value": 1}
     sql_speed = sa.Column(sa.Float, name="speed")
 
     def __init__(self):
@@ -135,6 +182,7 @@ class Priority(BaseComponent):
 
 class Strength(BaseComponent):
     __slots__ = ("value",)
+    __columns__ = {"value": 1}
     sql_strength = sa.Column(sa.Integer, name="strength")
 
     def __init__(self):
@@ -149,6 +197,7 @@ class Strength(BaseComponent):
 
 class Hunger(BaseComponent):
     __slots__ = ("value",)
+    __columns__ = {"value": 1}
     sql_hunger = sa.Column(sa.Integer, name="hunger")
 
     def __init__(self):
@@ -165,8 +214,14 @@ class BushTag(BaseComponent):
     pass
 
 
+# Copy of an entity owned by a neighbouring shard, updated by its owner while it stays near the border.
+class GhostTag(BaseComponent):
+    pass
+
+
 class Rigidbody(BaseComponent):
     __slots__ = ("radius", "velocity")
+    __columns__ = {"radius": 1, "velocity": 2}
     sql_radius = sa.Column(sa.Float, name="radius")
     sql_velocity_x = sa.Column(sa.Float, name="velocity_x")
     sql_velocity_y = sa.Column(sa.Float, name="velocity_y")
@@ -187,6 +242,7 @@ class Rigidbody(BaseComponent):
 
 class Health(BaseComponent):
     __slots__ = ("value",)
+    __columns__ = {"value": 1}
     sql_health = sa.Column(sa.Float, name="health")
 
     def __init__(self):
@@ -229,6 +285,7 @@ class DeadTag(BaseComponent):
 
 class LifeTime(BaseComponent):
     __slots__ = ("value",)
+    __columns__ = {"value": 1}
     sql_time = sa.Column(sa.Float, name="time")
 
     def __init__(self):
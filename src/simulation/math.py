@@ -1,6 +1,11 @@
 from typing import Tuple
 from math import sqrt
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Vector:
     __slots__ = ("x", "y")
@@ -84,4 +89,96 @@ class Vector:
         return sqrt(self.sqr_len())
 
     def __hash__(self):
-        return hash(self.to_tuple())
\ No newline at end of file
+        return hash(self.to_tuple())
+
+
+# In-place kernels for hot loops. They give the same results as the operator chains noted next to them,
+# but write into existing vectors instead of creating temporaries.
+
+def sqr_distance(a: Vector, b: Vector) -> float:
+    # (b - a).sqr_len()
+    dx = b.x - a.x
+    dy = b.y - a.y
+    return dx * dx + dy * dy
+
+
+def add_direction(vector: Vector, origin: Vector, target: Vector, length: float) -> None:
+    # vector += (target - origin).normalized() * length
+    dx = target.x - origin.x
+    dy = target.y - origin.y
+    distance = sqrt(dx * dx + dy * dy)
+    if distance:
+        vector.x += dx / distance * length
+        vector.y += dy / distance * length
+
+
+def scale_to_length(vector: Vector, length: float) -> None:
+    # vector = vector.normalized() * length
+    current = sqrt(vector.x * vector.x + vector.y * vector.y)
+    if current:
+        vector.x = vector.x / current * length
+        vector.y = vector.y / current * length
+    else:
+        vector.x = vector.y = 0
+
+
+def move_towards(position: Vector, target: Vector, step: float, snap_sqr_distance: float) -> bool:
+    # Moves the position by step towards the target. Once the squared distance is at most snap_sqr_distance,
+    # the position is set onto the target instead and True is returned.
+    dx = target.x - position.x
+    dy = target.y - position.y
+    sqr_length = dx * dx + dy * dy
+    if sqr_length <= snap_sqr_distance:
+        position.x = target.x
+        position.y = target.y
+        return True
+    distance = sqrt(sqr_length)
+    position.x += dx / distance * step
+    position.y += dy / distance * step
+    return False
+
+
+def clamp_length(vector: Vector, max_length: float) -> None:
+    # Vectors longer than max_length are scaled down onto it, shorter ones stay untouched.
+    sqr_length = vector.x * vector.x + vector.y * vector.y
+    if sqr_length > max_length * max_length:
+        scale_to_length(vector, max_length)
+
+
+# Batch versions work on NumPy arrays of shape (n, 2) in place, row by row like the scalar kernels.
+
+def sqr_distances(origins, targets):
+    diff = targets - origins
+    return diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1]
+
+
+def scale_to_lengths(vectors, lengths) -> None:
+    # Zero rows stay zero, like scale_to_length.
+    current = np.sqrt(vectors[:, 0] * vectors[:, 0] + vectors[:, 1] * vectors[:, 1])
+    current[current == 0] = np.inf
+    vectors[:, 0] = vectors[:, 0] / current * lengths
+    vectors[:, 1] = vectors[:, 1] / current * lengths
+
+
+def move_towards_batch(positions, targets, steps, snap_sqr_distances, mask=None):
+    # Rows outside the mask or with a NaN target stay still. Returns the mask of rows that reached the target.
+    diff = targets - positions
+    sqr_length = diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1]
+    active = ~np.isnan(sqr_length)
+    if mask is not None:
+        active &= mask
+    arrived = active & (sqr_length <= snap_sqr_distances)
+    moving = active & ~arrived
+    distance = np.sqrt(sqr_length[moving])
+    step = steps[moving]
+    positions[moving, 0] += diff[moving, 0] / distance * step
+    positions[moving, 1] += diff[moving, 1] / distance * step
+    positions[arrived] = targets[arrived]
+    return arrived
+
+
+def clamp_lengths(points, max_length: float) -> None:
+    sqr_length = points[:, 0] * points[:, 0] + points[:, 1] * points[:, 1]
+    outside = sqr_length > max_length * max_length
+    length = np.sqrt(sqr_length[outside])
+    points[outside] = points[outside] / length[:, None] * max_length
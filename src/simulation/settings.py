@@ -27,6 +27,7 @@ SPEED_HUNGER_MULTIPLIER: float = 0.28
 
 PUSH_MULTIPLIER: float = 0.1
 DAMPENING: float = 0.18
+COLLISION_CELL_SCALE: float = 2
 
 EVOLVE_HUNGER_VALUE: float = 300
 EVOLVE_HUNGER_COST: float = 90
@@ -44,3 +45,6 @@ SAVE_DELAY: float = 240
 REPRODUCE_DELAY: float = 30
 REPRODUCE_CHANCE: float = 0.08
 ATTACK_DISTANCE: float = 25
+
+SHARD_GHOST_MARGIN: float = 30
+SHARD_REFRESH_SYNCS: int = 30
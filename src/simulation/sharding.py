@@ -0,0 +1,480 @@
+from math import atan2, cos, sin, pi
+from multiprocessing import get_context
+from signal import signal, SIGINT, SIG_IGN
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple, Type
+from src.ecs.component import BaseComponent
+from src.ecs.entities import ComponentDataArray, Entity, EntityManager, EntityNotFoundError
+from src.ecs.world import World
+from .components import Position, Rigidbody, RenderSprite, GhostTag, UserId, EntityName, BushTag, DeadTag
+from .math import Vector
+from .settings import MAX_CREATURES, MAX_FOOD, SHARD_GHOST_MARGIN, SHARD_REFRESH_SYNCS
+
+
+class ShardLayout:
+    # Splits the world into equal angular sectors around its centre, one per shard.
+    __slots__ = ("count", "__width")
+
+    def __init__(self, count: int):
+        self.count = count
+        self.__width = 2 * pi / count
+
+    def get_shard(self, position: Vector) -> int:
+        if self.count == 1:
+            return 0
+        angle = atan2(position.y, position.x) % (2 * pi)
+        return min(int(angle / self.__width), self.count - 1)
+
+    def get_distance(self, position: Vector, shard: int) -> float:
+        if self.get_shard(position) == shard:
+            return 0
+        return min(self.__ray_distance(position, shard * self.__width),
+                   self.__ray_distance(position, (shard + 1) * self.__width))
+
+    @staticmethod
+    def __ray_distance(position: Vector, angle: float) -> float:
+        direction_x, direction_y = cos(angle), sin(angle)
+        if position.x * direction_x + position.y * direction_y <= 0:
+            return position.len()
+        return abs(position.x * direction_y - position.y * direction_x)
+
+    def get_ghost_shards(self, position: Vector, shard: int, margin: float) -> List[int]:
+        return [i for i in range(self.count) if i != shard and self.get_distance(position, i) < margin]
+
+
+class EntitySnapshot:
+    # Picklable copy of an entity's components, sent between processes.
+    __slots__ = ("token", "components")
+
+    def __init__(self, token: Hashable, components: List[Tuple[str, Dict[str, object]]]):
+        self.token = token
+        self.components = components
+
+    def get_position(self) -> Vector:
+        for name, values in self.components:
+            if name == Position.__name__:
+                return values["value"]
+
+
+_attributes: Dict[Type[BaseComponent], List[str]] = dict()
+_component_types: Dict[str, Type[BaseComponent]] = dict()
+
+
+def get_attributes(component_type: Type[BaseComponent]) -> List[str]:
+    attributes = _attributes.get(component_type, None)
+    if attributes is None:
+        attributes = _attributes[component_type] = [
+            f"_{component_type.__name__}{slot}" if slot.startswith("__") else slot
+            for slot in component_type.__dict__.get("__slots__", ())]
+    return attributes
+
+
+def get_component_type(name: str) -> Type[BaseComponent]:
+    if not _component_types:
+        _component_types.update((i.__name__, i) for i in BaseComponent.__subclasses__())
+    return _component_types[name]
+
+
+def get_values(component: BaseComponent) -> Dict[str, object]:
+    if type(component) is RenderSprite:
+        return {"factory": component.get_factory()}
+    values = dict()
+    for name in get_attributes(type(component)):
+        value = getattr(component, name)
+        values[name] = Vector.clone(value) if isinstance(value, Vector) else value
+    return values
+
+
+def set_values(component: BaseComponent, values: Dict[str, object]) -> None:
+    if type(component) is RenderSprite:
+        component.set_factory(values["factory"])
+        return
+    for attribute, value in values.items():
+        setattr(component, attribute, value)
+
+
+def take_snapshot(record: ComponentDataArray, token: Hashable,
+                  skip: Sequence[Type[BaseComponent]] = ()) -> EntitySnapshot:
+    components = [(component_type.__name__, get_values(component))
+                  for component_type, component in record.components.items() if component_type not in skip]
+    return EntitySnapshot(token, components)
+
+
+def apply_snapshot(entity_manager: EntityManager, entity: Entity, snapshot: EntitySnapshot,
+                   keep: Sequence[Type[BaseComponent]] = ()) -> None:
+    # Existing components are updated in place, so a built sprite survives the update.
+    present = set(keep)
+    for name, values in snapshot.components:
+        component_type = get_component_type(name)
+        present.add(component_type)
+        component = entity_manager.get_component(entity, component_type)
+        if component is None:
+            component = component_type()
+            set_values(component, values)
+            entity_manager.add_component(entity, component)
+        elif component_type is not RenderSprite:
+            set_values(component, values)
+    for component in entity_manager.get_entities()[entity]:
+        if type(component) not in present:
+            entity_manager.remove_component(entity, type(component))
+
+
+class Shard:
+    # A headless world that owns one sector of the map. Entities of the neighbouring shards within
+    # SHARD_GHOST_MARGIN of its border are kept as ghosts and updated in place while they stay there.
+    __slots__ = ("__index", "__layout", "__world", "__manager", "__own_filter", "__create_food", "__reproduce",
+                 "__ghosts", "__ghost_bushes", "__ghosted", "__reported", "__syncs", "__messages")
+
+    def __init__(self, index: int, count: int):
+        from src.core.application import Application
+        from src.vk_bot.commands import BotMethods
+
+        Application(headless=True)
+        from .systems import CreateFood, ReproduceSystem, BotCreationSystem
+        self.__index = index
+        self.__layout = ShardLayout(count)
+        self.__world = World.default_world
+        self.__world.create_all_systems(render=False)
+        # New bots appear only once, the caps on food and creatures are set by the coordinator on every step.
+        self.__world.set_system_state(BotCreationSystem, index == 0)
+        self.__create_food = self.__world.get_system(CreateFood)
+        self.__reproduce = self.__world.get_system(ReproduceSystem)
+        self.__manager = self.__world.get_manager()
+        self.__own_filter = self.__manager.create_filter(required=(Position,), without=(GhostTag,))
+        # Ghosts by the token of their entity in the owning shard.
+        self.__ghosts: Dict[Hashable, Entity] = dict()
+        self.__ghost_bushes: Set[Hashable] = set()
+        # Shards that have a ghost of an own entity, by its handle. Bushes do not move, so they are checked once.
+        self.__ghosted: Dict[int, List[int]] = dict()
+        # Position and component types of every own entity as the coordinator last got them.
+        self.__reported: Dict[int, Tuple[Tuple[float, float], Tuple[type, ...]]] = dict()
+        self.__syncs = 0
+        self.__messages = []
+        BotMethods.redirect_messages(self.__messages)
+
+    def step(self, adds: List[EntitySnapshot], removes: List[int], ghosts: List[EntitySnapshot],
+             unghosts: List[Hashable], edits: List[Tuple[int, str, Dict[str, object]]], eaten: List[int],
+             max_food: int, max_creatures: int, delta_time: float) -> tuple:
+        from src.sql.data import EntryDeletionStack
+        manager = self.__manager
+        for handle in removes:
+            # Killed in the main process, which has already dropped its copy.
+            self.__reported.pop(handle, None)
+            entity = self.__find(handle)
+            if entity is not None:
+                manager.kill_entity(entity)
+        added = []
+        for snapshot in adds:
+            entity = manager.create_entity()
+            apply_snapshot(manager, entity, snapshot)
+            added.append((snapshot.token, entity.get_handle()))
+        for token in unghosts:
+            self.__ghost_bushes.discard(token)
+            entity = self.__ghosts.pop(token, None)
+            if entity is not None and manager.has_entity(entity):
+                manager.kill_entity(entity)
+        for snapshot in ghosts:
+            entity = self.__ghosts.get(snapshot.token, None)
+            if entity is None or not manager.has_entity(entity):
+                entity = self.__ghosts[snapshot.token] = manager.create_entity()
+                manager.add_component(entity, GhostTag())
+            apply_snapshot(manager, entity, snapshot, keep=(GhostTag,))
+            if manager.get_component(entity, BushTag) is not None:
+                self.__ghost_bushes.add(snapshot.token)
+        for handle, name, values in edits:
+            entity = self.__find(handle)
+            if entity is None:
+                continue
+            component_type = get_component_type(name)
+            component = manager.get_component(entity, component_type)
+            if component is None:
+                component = component_type()
+                set_values(component, values)
+                manager.add_component(entity, component)
+            else:
+                set_values(component, values)
+        for handle in eaten:
+            # A bush whose ghost was eaten in a neighbouring shard.
+            entity = self.__find(handle)
+            if entity is not None and manager.get_component(entity, DeadTag) is None:
+                manager.add_component(entity, DeadTag("съедения"))
+
+        entities = manager.get_entities()
+        self.__create_food.max_food = max_food
+        self.__reproduce.max_creatures = max_creatures
+        self.__world.step(delta_time)
+        # Nothing is saved from a shard, so removed components are not kept for the database.
+        EntryDeletionStack.clear()
+        counts = (len(entities.filter(self.__create_food.filter)), len(entities.filter(self.__reproduce.filter)))
+
+        eaten = []
+        for token in list(self.__ghost_bushes):
+            # KillSystem leaves ghosts alone; an eaten ghost bush is dropped here and killed by its owner.
+            entity = self.__ghosts[token]
+            if manager.get_component(entity, DeadTag) is not None:
+                self.__ghost_bushes.discard(token)
+                del self.__ghosts[token]
+                manager.kill_entity(entity)
+                eaten.append(token)
+
+        index = self.__index
+        layout = self.__layout
+        outgoing = []
+        border = []
+        ghosted = dict()
+        for record in list(entities.filter(self.__own_filter)):
+            handle = record.entity.get_handle()
+            position = record.get_component(Position).value
+            if layout.get_shard(position) != index:
+                self.__reported.pop(handle, None)
+                outgoing.append(take_snapshot(record, (index, handle)))
+                manager.kill_entity(record.entity)
+                continue
+            is_bush = record.get_component(BushTag) is not None
+            if is_bush and handle in self.__ghosted:
+                ghosted[handle] = self.__ghosted[handle]
+            elif is_bush or record.get_component(Rigidbody) is not None:
+                shards = layout.get_ghost_shards(position, index, SHARD_GHOST_MARGIN)
+                if shards or is_bush:
+                    ghosted[handle] = shards
+                if shards:
+                    border.append((shards, take_snapshot(record, (index, handle), skip=(UserId, EntityName))))
+        unghosted = []
+        for handle, shards in self.__ghosted.items():
+            current = ghosted.get(handle, ())
+            left = [i for i in shards if i not in current]
+            if left:
+                unghosted.append((left, (index, handle)))
+        self.__ghosted = ghosted
+
+        messages = list(self.__messages)
+        self.__messages.clear()
+        return added, outgoing, border, unghosted, eaten, counts, messages
+
+    def sync(self, collect: bool) -> tuple:
+        # What the main process's copy is missing: new and changed entities in full, moved ones as positions.
+        # Every entity is also sent in full once per SHARD_REFRESH_SYNCS syncs, for the values that change
+        # without changing its components, and all of them are when collect is set.
+        phase = self.__syncs % SHARD_REFRESH_SYNCS
+        self.__syncs += 1
+        snapshots = []
+        positions = []
+        reported = dict()
+        for record in self.__manager.get_entities().filter(self.__own_filter):
+            handle = record.entity.get_handle()
+            position = record.get_component(Position).value
+            state = ((position.x, position.y), tuple(record.components))
+            last = self.__reported.get(handle, None)
+            if collect or last is None or last[1] != state[1] or handle % SHARD_REFRESH_SYNCS == phase:
+                snapshots.append(take_snapshot(record, (self.__index, handle)))
+            elif last[0] != state[0]:
+                positions.append((handle, Vector.clone(position)))
+            reported[handle] = state
+        removed = [i for i in self.__reported if i not in reported]
+        self.__reported = reported
+        return snapshots, positions, removed
+
+    def __find(self, handle: int) -> Optional[Entity]:
+        try:
+            return self.__manager.get_entity_by_handle(handle)
+        except EntityNotFoundError:
+            return None
+
+
+def run_shard(index: int, count: int, connection) -> None:
+    # Entry point of a shard process.
+    # Ctrl+C reaches the whole process group, the coordinator stops the shards itself.
+    signal(SIGINT, SIG_IGN)
+    shard = Shard(index, count)
+    while True:
+        message = connection.recv()
+        if message[0] == "stop":
+            break
+        if message[0] == "sync":
+            connection.send(shard.sync(*message[1:]))
+        else:
+            connection.send(shard.step(*message[1:]))
+
+
+class ShardCoordinator:
+    # Runs the simulation in shard processes and mirrors their entities into the local world.
+    # Entities move between shards as snapshots. Creatures and bushes near a border have ghosts in the neighbouring
+    # shards, so collisions, damage, hunting and gathering work across the border.
+    __slots__ = ("__layout", "__processes", "__connections", "__adds", "__removes", "__ghosts", "__unghosts",
+                 "__edits", "__eaten", "__pending", "__mirror", "__tokens", "__in_flight", "__removed",
+                 "__counts", "__step_count", "__position_filter")
+
+    def __init__(self, count: int):
+        self.__layout = ShardLayout(count)
+        self.__processes = []
+        self.__connections = []
+        context = get_context("spawn")
+        for index in range(count):
+            connection, child_connection = context.Pipe()
+            process = context.Process(target=run_shard, args=(index, count, child_connection), daemon=True)
+            process.start()
+            self.__processes.append(process)
+            self.__connections.append(connection)
+        self.__adds: List[List[EntitySnapshot]] = [[] for _ in range(count)]
+        self.__removes: List[List[int]] = [[] for _ in range(count)]
+        self.__ghosts: List[List[EntitySnapshot]] = [[] for _ in range(count)]
+        self.__unghosts: List[List[Hashable]] = [[] for _ in range(count)]
+        self.__edits: List[List[Tuple[int, str, Dict[str, object]]]] = [[] for _ in range(count)]
+        self.__eaten: List[List[int]] = [[] for _ in range(count)]
+        # Edits of entities on their way to a shard, sent once it reports their handle.
+        self.__pending: Dict[Hashable, List[Tuple[str, Dict[str, object]]]] = dict()
+        # Snapshot token of every mirrored entity: (shard, handle), or ("mirror", handle) for entities
+        # created locally that no shard has taken yet.
+        self.__mirror: Dict[Hashable, Entity] = dict()
+        self.__tokens: Dict[Entity, Hashable] = dict()
+        self.__in_flight: Set[Hashable] = set()
+        self.__removed: Set[Hashable] = set()
+        # Food and creatures of every shard after the previous step.
+        self.__counts: Optional[List[Tuple[int, int]]] = None
+        self.__step_count = 0
+        self.__position_filter = EntityManager.create_filter(required=(Position,))
+
+    def add(self, snapshot: EntitySnapshot) -> None:
+        self.__adds[self.__layout.get_shard(snapshot.get_position())].append(snapshot)
+        self.__in_flight.add(snapshot.token)
+
+    def edit(self, entity: Entity, component: BaseComponent) -> None:
+        # Forwards a component added or changed in the local world to the shard that owns the entity.
+        token = self.__tokens.get(entity, None)
+        if token is None:
+            # Not mirrored yet, the next sync hands it to a shard as it is.
+            return
+        edit = (type(component).__name__, get_values(component))
+        if token in self.__in_flight:
+            self.__pending.setdefault(token, []).append(edit)
+        else:
+            self.__edits[token[0]].append((token[1],) + edit)
+
+    def step(self, delta_time: float) -> None:
+        from src.vk_bot.commands import BotMethods
+        count = self.__layout.count
+        budgets = self.__get_budgets()
+        removes = self.__removes
+        for index, connection in enumerate(self.__connections):
+            connection.send(("step", self.__adds[index], removes[index], self.__ghosts[index],
+                             self.__unghosts[index], self.__edits[index], self.__eaten[index],
+                             budgets[index][0], budgets[index][1], delta_time))
+        self.__adds = [[] for _ in range(count)]
+        self.__removes = [[] for _ in range(count)]
+        self.__ghosts = [[] for _ in range(count)]
+        self.__unghosts = [[] for _ in range(count)]
+        self.__edits = [[] for _ in range(count)]
+        self.__eaten = [[] for _ in range(count)]
+        self.__step_count += 1
+
+        counts = []
+        for index, connection in enumerate(self.__connections):
+            added, outgoing, border, unghosted, eaten, shard_counts, messages = connection.recv()
+            for token, handle in added:
+                self.__rekey(token, (index, handle))
+            for snapshot in outgoing:
+                self.add(snapshot)
+            for shards, snapshot in border:
+                for shard in shards:
+                    self.__ghosts[shard].append(snapshot)
+            for shards, token in unghosted:
+                for shard in shards:
+                    self.__unghosts[shard].append(token)
+            for token in eaten:
+                self.__eaten[token[0]].append(token[1])
+            counts.append(shard_counts)
+            for peer_id, message in messages:
+                BotMethods.send_message(peer_id, message)
+        self.__counts = counts
+        for index, handles in enumerate(removes):
+            self.__removed.difference_update((index, handle) for handle in handles)
+
+    def sync(self, entity_manager: EntityManager, collect: bool = False) -> None:
+        for key, entity in list(self.__mirror.items()):
+            if not entity_manager.has_entity(entity):
+                # Killed locally, e.g. by a bot command.
+                self.__pop(key)
+                self.__remove(key)
+
+        for connection in self.__connections:
+            connection.send(("sync", collect))
+        for index, connection in enumerate(self.__connections):
+            snapshots, positions, removed = connection.recv()
+            for snapshot in snapshots:
+                if snapshot.token in self.__removed:
+                    continue
+                entity = self.__mirror.get(snapshot.token, None)
+                if entity is None:
+                    entity = entity_manager.create_entity()
+                    self.__mirror[snapshot.token] = entity
+                    self.__tokens[entity] = snapshot.token
+                apply_snapshot(entity_manager, entity, snapshot)
+            for handle, position in positions:
+                entity = self.__mirror.get((index, handle), None)
+                if entity is not None:
+                    entity_manager.get_component(entity, Position).value = position
+            for handle in removed:
+                entity = self.__pop((index, handle))
+                if entity is not None:
+                    entity_manager.kill_entity(entity)
+
+        for record in list(entity_manager.get_entities().filter(self.__position_filter)):
+            if record.entity not in self.__tokens:
+                token = ("mirror", record.entity.get_handle())
+                self.__mirror[token] = record.entity
+                self.__tokens[record.entity] = token
+                self.add(take_snapshot(record, token))
+
+    def stop(self) -> None:
+        for connection in self.__connections:
+            connection.send(("stop",))
+        for process in self.__processes:
+            process.join()
+
+    def __get_budgets(self) -> List[Tuple[int, int]]:
+        # The caps of every shard on its own food and creatures, from what the shards counted after the previous
+        # step, so that together they hold MAX_FOOD and MAX_CREATURES like a single world does. New food appears
+        # anywhere in the world, so one shard at a time makes it, up to the room the others leave. Creatures
+        # are born next to their parents, so MAX_CREATURES is split in proportion to the creatures of each shard.
+        count = self.__layout.count
+        if self.__counts is None:
+            return [(0, 0)] * count
+        turn = self.__step_count % count
+        food = [0] * count
+        food[turn] = MAX_FOOD - sum(i[0] for index, i in enumerate(self.__counts) if index != turn)
+        total = sum(i[1] for i in self.__counts)
+        if total:
+            creatures = [MAX_CREATURES * i[1] // total for i in self.__counts]
+        else:
+            creatures = [MAX_CREATURES // count] * count
+        for index in range(MAX_CREATURES - sum(creatures)):
+            creatures[(turn + index) % count] += 1
+        return list(zip(food, creatures))
+
+    def __pop(self, key: Hashable) -> Optional[Entity]:
+        entity = self.__mirror.pop(key, None)
+        if entity is not None:
+            del self.__tokens[entity]
+        return entity
+
+    def __remove(self, key: Hashable) -> None:
+        # Updates of the entity are ignored until its shard has dropped it. If no shard owns it yet,
+        # it is removed once a shard reports its handle.
+        self.__pending.pop(key, None)
+        self.__removed.add(key)
+        if key not in self.__in_flight and key[0] != "mirror":
+            self.__removes[key[0]].append(key[1])
+
+    def __rekey(self, token: Hashable, key: Tuple[int, int]) -> None:
+        self.__in_flight.discard(token)
+        if token in self.__removed:
+            # Killed locally while on its way; kept in the removed set until the shard has dropped it.
+            self.__removed.discard(token)
+            self.__removed.add(key)
+            self.__removes[key[0]].append(key[1])
+            return
+        entity = self.__pop(token)
+        if entity is not None:
+            self.__mirror[key] = entity
+            self.__tokens[entity] = key
+        for name, values in self.__pending.pop(token, ()):
+            self.__edits[key[0]].append((key[1], name, values))
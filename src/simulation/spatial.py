@@ -0,0 +1,202 @@
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+from math import floor
+from .math import Vector
+
+
+TItem = TypeVar("TItem")
+Entry = Tuple[float, float, int, TItem]
+
+
+class SpatialGrid:
+    __slots__ = ("cell_size", "__cells", "__count", "__bounds")
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.__cells: Dict[Tuple[int, int], List[Entry]] = dict()
+        self.__count = 0
+        self.__bounds = None
+
+    def __len__(self):
+        return self.__count
+
+    def clear(self) -> None:
+        self.__cells.clear()
+        self.__count = 0
+        self.__bounds = None
+
+    def get_cell(self, x: float, y: float) -> Tuple[int, int]:
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    def insert(self, item: TItem, position: Vector) -> None:
+        self.insert_point(item, position.x, position.y)
+
+    def insert_point(self, item: TItem, x: float, y: float) -> None:
+        cell = self.get_cell(x, y)
+        bucket = self.__cells.get(cell, None)
+        if bucket is None:
+            bucket = self.__cells[cell] = []
+        # The insertion number breaks distance ties, so results follow insertion order like a linear scan would.
+        bucket.append((x, y, self.__count, item))
+        self.__count += 1
+        if self.__bounds is None:
+            self.__bounds = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            bounds = self.__bounds
+            bounds[0] = min(bounds[0], cell[0])
+            bounds[1] = min(bounds[1], cell[1])
+            bounds[2] = max(bounds[2], cell[0])
+            bounds[3] = max(bounds[3], cell[1])
+
+    def query_radius(self, position: Vector, radius: float,
+                     predicate: Callable[[TItem], bool] = None) -> List[TItem]:
+        x, y = position.x, position.y
+        min_x, min_y = self.get_cell(x - radius, y - radius)
+        max_x, max_y = self.get_cell(x + radius, y + radius)
+        sqr_radius = radius * radius
+        found = []
+        cells = self.__cells
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                bucket = cells.get((cell_x, cell_y), None)
+                if bucket is None:
+                    continue
+                for entry_x, entry_y, order, item in bucket:
+                    dx = entry_x - x
+                    dy = entry_y - y
+                    if dx * dx + dy * dy <= sqr_radius and (predicate is None or predicate(item)):
+                        found.append((order, item))
+        found.sort(key=lambda entry: entry[0])
+        return [item for _, item in found]
+
+    def nearest(self, position: Vector, predicate: Callable[[TItem], bool] = None,
+                max_distance: float = None) -> Optional[TItem]:
+        found = self.k_nearest(position, 1, predicate, max_distance)
+        return found[0] if found else None
+
+    def k_nearest(self, position: Vector, k: int, predicate: Callable[[TItem], bool] = None,
+                  max_distance: float = None) -> List[TItem]:
+        # Searches rings of cells around the query cell. Every point outside ring r is at least
+        # r * cell_size away, so the search stops once k closer candidates are known.
+        # Only items strictly closer than max_distance are returned.
+        if self.__bounds is None or k <= 0:
+            return []
+        x, y = position.x, position.y
+        center_x, center_y = self.get_cell(x, y)
+        min_x, min_y, max_x, max_y = self.__bounds
+        last_ring = max(center_x - min_x, max_x - center_x, center_y - min_y, max_y - center_y, 0)
+        sqr_max_distance = max_distance * max_distance if max_distance is not None else None
+        found = []
+        cells = self.__cells
+        for ring in range(last_ring + 1):
+            for cell in self.__ring_cells(center_x, center_y, ring):
+                bucket = cells.get(cell, None)
+                if bucket is None:
+                    continue
+                for entry_x, entry_y, order, item in bucket:
+                    dx = entry_x - x
+                    dy = entry_y - y
+                    sqr_distance = dx * dx + dy * dy
+                    if sqr_max_distance is not None and sqr_distance >= sqr_max_distance:
+                        continue
+                    if predicate is None or predicate(item):
+                        found.append((sqr_distance, order, item))
+            reach = ring * self.cell_size
+            if len(found) >= k:
+                found.sort(key=lambda entry: (entry[0], entry[1]))
+                del found[k:]
+                if found[-1][0] < reach * reach:
+                    break
+            if sqr_max_distance is not None and reach * reach >= sqr_max_distance:
+                break
+        found.sort(key=lambda entry: (entry[0], entry[1]))
+        return [item for _, _, item in found[:k]]
+
+    @staticmethod
+    def __ring_cells(center_x: int, center_y: int, ring: int):
+        if ring == 0:
+            yield center_x, center_y
+            return
+        for dx in range(-ring, ring + 1):
+            yield center_x + dx, center_y - ring
+            yield center_x + dx, center_y + ring
+        for dy in range(-ring + 1, ring):
+            yield center_x - ring, center_y + dy
+            yield center_x + ring, center_y + dy
+
+
+class KDNode:
+    __slots__ = ("x", "y", "order", "item", "axis", "left", "right", "alive")
+
+    def __init__(self, x: float, y: float, order: int, item: TItem, axis: int):
+        self.x = x
+        self.y = y
+        self.order = order
+        self.item = item
+        self.axis = axis
+        self.left: Optional[KDNode] = None
+        self.right: Optional[KDNode] = None
+        self.alive = True
+
+
+class KDTree:
+    # Two-dimensional k-d tree. Removed items stay in the tree as dead nodes until the next rebuild.
+    __slots__ = ("__root", "__nodes", "__count")
+
+    def __init__(self):
+        self.__root: Optional[KDNode] = None
+        self.__nodes: Dict[TItem, KDNode] = dict()
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def build(self, items: List[Tuple[TItem, Vector]]) -> None:
+        self.__nodes.clear()
+        nodes = []
+        for order, (item, position) in enumerate(items):
+            node = KDNode(position.x, position.y, order, item, 0)
+            self.__nodes[item] = node
+            nodes.append(node)
+        self.__count = len(nodes)
+        self.__root = self.__build(nodes, 0)
+
+    def __build(self, nodes: List[KDNode], axis: int) -> Optional[KDNode]:
+        if not nodes:
+            return None
+        nodes.sort(key=(lambda node: node.x) if axis == 0 else (lambda node: node.y))
+        median = len(nodes) // 2
+        node = nodes[median]
+        node.axis = axis
+        node.left = self.__build(nodes[:median], 1 - axis)
+        node.right = self.__build(nodes[median + 1:], 1 - axis)
+        return node
+
+    def remove(self, item: TItem) -> None:
+        node = self.__nodes.pop(item, None)
+        if node is not None and node.alive:
+            node.alive = False
+            self.__count -= 1
+
+    def nearest(self, position: Vector) -> Optional[TItem]:
+        # Equally distant items resolve to the earliest inserted one, like a linear scan would.
+        best = self.__search(self.__root, position.x, position.y, None)
+        return best[2].item if best is not None else None
+
+    def __search(self, node: Optional[KDNode], x: float, y: float, best):
+        if node is None:
+            return best
+        if node.alive:
+            dx = node.x - x
+            dy = node.y - y
+            sqr_distance = dx * dx + dy * dy
+            if best is None or sqr_distance < best[0] or sqr_distance == best[0] and node.order < best[1]:
+                best = (sqr_distance, node.order, node)
+        diff = x - node.x if node.axis == 0 else y - node.y
+        if diff < 0:
+            near, far = node.left, node.right
+        else:
+            near, far = node.right, node.left
+        best = self.__search(near, x, y, best)
+        if far is not None and (best is None or diff * diff <= best[0]):
+            best = self.__search(far, x, y, best)
+        return best
@@ -1,19 +1,26 @@
-from math import ceil
+from math import sqrt
+from typing import Dict, List, Tuple
 from random import random, randint, choice
 
 import pygame
+from pygame import sprite
 
 from src.core.input import Mouse
-from src.ecs.systems import BaseSystem
+from src.ecs.systems import BaseSystem, SharedRandom
 from src.ecs.world import World
 from .__all_components import *
 from .settings import *
 from .utils import create_food, create_named_creature, TEAM_COLORS
-from src.ecs.entities import EntityNotFoundError
+from .spatial import SpatialGrid, KDTree
+from .math import add_direction, clamp_length, clamp_lengths, move_towards, move_towards_batch, scale_to_lengths, \
+    sqr_distances
+from src.ecs.entities import ComponentDataArray, EntityNotFoundError
+from src.ecs.columns import np
 
 
 class RenderSystem(BaseSystem):
     __update_order__ = 100
+    __render__ = True
 
     def __init__(self):
         self.__sprites = pygame.sprite.Group()
@@ -21,6 +28,10 @@ class RenderSystem(BaseSystem):
         from src.core.application import WIDTH, HEIGHT
         self.camera_position: Vector = -Vector(WIDTH / 2, HEIGHT / 2)
         self.filter = None
+        self.__step = -1
+        self.__previous_positions = dict()
+        self.__latest_positions = dict()
+        self.__interpolation = 0
 
     def on_create(self):
         from src.core.application import Application
@@ -29,6 +40,13 @@ class RenderSystem(BaseSystem):
                                                         without=(DeadTag,))
 
     def on_update(self, delta_time: float):
+        step = World.current_world.get_step_count()
+        if step != self.__step:
+            self.__step = step
+            self.__previous_positions = self.__latest_positions
+            self.__latest_positions = {i: i.get_component(Position).value.to_tuple() for i in self.query(self.filter)}
+        self.__interpolation = World.current_world.get_interpolation()
+
         cached_positions = []
         for i in self.query(self.filter):
 
@@ -38,15 +56,25 @@ class RenderSystem(BaseSystem):
 
             position_comp = i.get_component(Position)
             cached_positions.append((render_comp.sprite, position_comp.value.to_tuple()))
-            render_comp.sprite.rect.center = (position_comp.value - self.camera_position).to_tuple()
+            render_comp.sprite.rect.center = (self.get_render_position(i) - self.camera_position).to_tuple()
 
         self.__sprites.draw(self.__render_surface)
 
         for i in cached_positions:
             i[0].rect.center = i[1]
 
+    def get_render_position(self, record) -> Vector:
+        # Simulation steps are coarser than frames, so sprites are drawn between the last two stepped positions.
+        position = record.get_component(Position).value
+        previous = self.__previous_positions.get(record, None)
+        if previous is None:
+            return Vector.clone(position)
+        t = self.__interpolation
+        return Vector(previous[0] + (position.x - previous[0]) * t, previous[1] + (position.y - previous[1]) * t)
+
 
 class MouseDragSystem(BaseSystem):
+    __render__ = True
 
     def __init__(self):
         self.__drag_position = None
@@ -71,6 +99,7 @@ class MouseDragSystem(BaseSystem):
 
 class EntityNameFollowSystem(BaseSystem):
     __update_order__ = 102
+    __render__ = True
 
     def __init__(self):
         self.__cached_positions = dict()
@@ -91,15 +120,12 @@ class EntityNameFollowSystem(BaseSystem):
         self.filter = self.entity_manager.create_filter(required=(Position, EntityName), additional=(DeadTag,))
 
     def on_update(self, delta_time: float) -> None:
+        names = set()
         for i in self.query(self.filter):
             name = i.get_component(EntityName).value
             if i.get_component(DeadTag) is not None:
-                try:
-                    self.__cache[name].kill()
-                    self.__cache.pop(name)
-                except KeyError:
-                    pass
                 continue
+            names.add(name)
             name_sprite = self.__cache.get(name, None)
             if name_sprite is None:
                 try:
@@ -110,179 +136,310 @@ class EntityNameFollowSystem(BaseSystem):
                     self.__cache[name] = name_sprite
                 except:
                     continue
-            pos = i.get_component(Position).value
+            pos = self.__render_system.get_render_position(i)
             name_sprite.rect.center = (pos + self.__name_offset - self.__render_system.camera_position).to_tuple()
+        # Several steps can run between two frames, so an entity may die and be removed before it is drawn again.
+        for name in [name for name in self.__cache if name not in names]:
+            self.__cache.pop(name).kill()
         self.__sprites.draw(self.__render_surface)
 
 
 class MoveToTargetSystem(BaseSystem):
+    __reads__ = (MoveSpeed,)
+    __writes__ = (Position, TargetPosition)
 
     def __init__(self):
         self.filter = None
 
     def on_create(self) -> None:
         self.filter = self.entity_manager.create_filter(required=(MoveSpeed, Position, TargetPosition),
-                                                        without=(DeadTag,))
+                                                        without=(DeadTag, GhostTag))
 
     def on_update(self, delta_time: float) -> None:
         for i in self.query(self.filter):
             target_pos_comp = i.get_component(TargetPosition)
-            pos_comp = i.get_component(Position)
             if target_pos_comp.value is not None:
-                target_pos = target_pos_comp.value
-                pos = pos_comp.value
                 speed = i.get_component(MoveSpeed).value
-                if (target_pos - pos).sqr_len() > speed * 0.5:
-                    pos += (target_pos - pos).normalized() * (speed * delta_time)
-                else:
-                    pos_comp.value = Vector.clone(target_pos)
+                if move_towards(i.get_component(Position).value, target_pos_comp.value,
+                                speed * delta_time, speed * 0.5):
                     target_pos_comp.value = None
 
+    def on_update_batch(self, delta_time: float) -> None:
+        for archetype in self.query(self.filter).archetypes:
+            if not archetype.records:
+                continue
+            target_comps = [i.get_component(TargetPosition) for i in archetype.records]
+            targets = np.array([(comp.value.x, comp.value.y) if comp.value is not None else (np.nan, np.nan)
+                                for comp in target_comps], dtype=np.float64)
+            speed = archetype.get_column(MoveSpeed, "value")
+            arrived = move_towards_batch(archetype.get_column(Position, "value"), targets,
+                                         speed * delta_time, speed * 0.5)
+            for row in np.flatnonzero(arrived):
+                target_comps[row].value = None
+
 
 class CreateFood(BaseSystem):
+    __update_interval__ = FOOD_CREATE_DELAY
+    __reads__ = (BushTag,)
+    __writes__ = ()
 
     def __init__(self):
-        self.time = 0
         self.filter = None
+        self.max_food = MAX_FOOD
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(BushTag,))
+        self.filter = self.entity_manager.create_filter(required=(BushTag,), without=(GhostTag,))
 
     def on_update(self, delta_time: float) -> None:
-        self.time += delta_time
-        if self.time >= FOOD_CREATE_DELAY:
-            if len(self.query(self.filter)) <= MAX_FOOD - 4:
-                for i in range(4):
-                    self.entity_manager.add_command(create_food, self.entity_manager,
-                                                    self.entity_manager.create_entity())
-            self.time = 0
+        if len(self.query(self.filter)) <= self.max_food - 4:
+            for i in range(4):
+                self.entity_manager.add_command(self.__create_food)
+
+    def __create_food(self) -> None:
+        create_food(self.entity_manager, self.entity_manager.create_entity())
 
 
 class HungerSystem(BaseSystem):
+    __update_interval__ = HUNGER_TICK_DELAY
+    __reads__ = (MoveSpeed, DeadTag)
+    __writes__ = (Hunger, Health)
 
     def __init__(self):
-        self.hunger_time = 0
         self.filter = None
 
     def on_create(self) -> None:
         self.filter = self.entity_manager.create_filter(required=(Hunger, Health), additional=(MoveSpeed,),
-                                                        without=(DeadTag,))
+                                                        without=(DeadTag, GhostTag))
 
     def on_update(self, delta_time: float) -> None:
-        self.hunger_time += delta_time
-        if self.hunger_time >= HUNGER_TICK_DELAY:
-            for i in self.query(self.filter):
-                speed_comp = i.get_component(MoveSpeed)
-                hunger_comp = i.get_component(Hunger)
-                hunger_comp.value -= 1
-                if speed_comp is not None:
-                    hunger_comp.value -= speed_comp.value * SPEED_HUNGER_MULTIPLIER
-                if hunger_comp.value <= 0:
-                    hp_comp = i.get_component(Health)
-                    hp_comp.value *= 0.9
-                    hp_comp.value -= 10
-                    hunger_comp.value = 0
+        for i in self.query(self.filter):
+            speed_comp = i.get_component(MoveSpeed)
+            hunger_comp = i.get_component(Hunger)
+            hunger_comp.value -= 1
+            if speed_comp is not None:
+                hunger_comp.value -= speed_comp.value * SPEED_HUNGER_MULTIPLIER
+            if hunger_comp.value <= 0:
+                hp_comp = i.get_component(Health)
+                hp_comp.value *= 0.9
+                hp_comp.value -= 10
+                hunger_comp.value = 0
+
+    def on_update_batch(self, delta_time: float) -> None:
+        for archetype in self.query(self.filter).archetypes:
+            if not archetype.records:
+                continue
+            hunger = archetype.get_column(Hunger, "value")
+            hunger -= 1
+            if MoveSpeed in archetype.types:
+                hunger -= archetype.get_column(MoveSpeed, "value") * SPEED_HUNGER_MULTIPLIER
+            starving = hunger <= 0
+            hp = archetype.get_column(Health, "value")
+            hp[starving] *= 0.9
+            hp[starving] -= 10
+            hunger[starving] = 0
+
+
+class SpatialIndex:
+    """Stands for the index of SpatialIndexSystem in read and write sets of systems that query it"""
+    pass
+
+
+class SpatialIndexSystem(BaseSystem):
+    # Positions at the start of every step, shared by the proximity systems and the hover tooltip.
+    # Bodies are indexed on every step; bushes never move, so their tree is built on its first query in a step.
+    # CollisionSystem moves the bodies after the index is built, so the systems after it query the index
+    # from the points it holds rather than from the current positions.
+    __update_order__ = -10
+    __reads__ = (Position, Rigidbody, Team, BushTag, DeadTag)
+    __writes__ = (SpatialIndex,)
+
+    def __init__(self):
+        self.filter = None
+        self.filter2 = None
+        # Records of every entity with a Rigidbody, in query order.
+        self.creatures = SpatialGrid(1)
+        # Where every record in creatures was when the index was built, and its insertion number.
+        self.points: Dict[ComponentDataArray, Tuple[float, float, int]] = dict()
+        self.__teams: Dict[int, SpatialGrid] = dict()
+        self.__is_teams_built = False
+        self.__food = KDTree()
+        self.__is_food_built = False
+
+    def on_create(self) -> None:
+        self.filter = self.entity_manager.create_filter(required=(Position, Rigidbody))
+        self.filter2 = self.entity_manager.create_filter(required=(Position, BushTag),
+                                                         without=(DeadTag,))
 
-            self.hunger_time = 0
+    def on_update(self, delta_time: float) -> None:
+        creatures = self.creatures
+        creatures.clear()
+        points = self.points
+        points.clear()
+        bodies = tuple(self.query(self.filter))
+        if bodies:
+            creatures.cell_size = max(max(i.get_component(Rigidbody).radius for i in bodies)
+                                      * COLLISION_CELL_SCALE, 1)
+        for n, i in enumerate(bodies):
+            position = i.get_component(Position).value
+            points[i] = (position.x, position.y, n)
+            creatures.insert(i, position)
+        self.__is_teams_built = False
+        self.__is_food_built = False
+
+    def get_teams(self) -> Dict[int, SpatialGrid]:
+        # The bodies of every team at the same points as in creatures, built on the first query in a step.
+        if not self.__is_teams_built:
+            teams = self.__teams
+            for grid in teams.values():
+                grid.clear()
+                grid.cell_size = self.creatures.cell_size
+            for i, (x, y, _) in self.points.items():
+                team_comp = i.get_component(Team)
+                if team_comp is None:
+                    continue
+                grid = teams.get(team_comp.value, None)
+                if grid is None:
+                    grid = teams[team_comp.value] = SpatialGrid(self.creatures.cell_size)
+                grid.insert_point(i, x, y)
+            self.__is_teams_built = True
+        return self.__teams
+
+    def get_food(self) -> KDTree:
+        # Bushes eaten during the step are removed from the tree by whoever ate them.
+        if not self.__is_food_built:
+            self.__food.build([(i, i.get_component(Position).value) for i in self.query(self.filter2)])
+            self.__is_food_built = True
+        return self.__food
 
 
 class GatheringSystem(BaseSystem):
+    __update_interval__ = 1.2
+    __reads__ = (Position, Priority, DeadTag)
+    # Eaten bushes are removed from the shared tree.
+    __writes__ = (TargetPosition, Hunger, Health, SpatialIndex)
 
     def __init__(self):
         self.filter = None
-        self.filter2 = None
-        self.time = 0
+        self.__spatial_index = None
 
     def on_create(self) -> None:
         self.filter = self.entity_manager.create_filter(required=(Position, TargetPosition, Hunger),
                                                         additional=(Health, Priority),
-                                                        without=(DeadTag,))
-        self.filter2 = self.entity_manager.create_filter(required=(Position, BushTag),
-                                                         without=(DeadTag,))
+                                                        without=(DeadTag, GhostTag))
+        self.__spatial_index = World.current_world.get_or_create_system(SpatialIndexSystem)
 
     def on_update(self, delta_time: float) -> None:
-        self.time += delta_time
-        if self.time < 1.2:
-            return
-        self.time = 0
-        bush_pos = []
-        for i in self.query(self.filter2):
-            bush_pos_comp = i.get_component(Position)
-            bush_pos.append((i.entity, bush_pos_comp.value))
-        if not bush_pos:
-            return
+        bushes = self.__spatial_index.get_food()
         for i in self.query(self.filter):
+            if not len(bushes):
+                break
             priority = i.get_component(Priority)
             if priority is not None and priority.current != "gathering":
                 continue
             creature_pos_comp = i.get_component(Position)
             creature_target_comp = i.get_component(TargetPosition)
             hp_comp = i.get_component(Health)
-            closest_bush = bush_pos[0]
-            for j in bush_pos:
-                if (creature_pos_comp.value - j[1]).sqr_len() < (
-                        creature_pos_comp.value - closest_bush[1]).sqr_len():
-                    closest_bush = j
-            creature_target_comp.value = closest_bush[1]
+            closest_bush = bushes.nearest(creature_pos_comp.value)
+            creature_target_comp.value = Vector.clone(closest_bush.get_component(Position).value)
             if (creature_target_comp.value - creature_pos_comp.value).sqr_len() <= EAT_DISTANCE * EAT_DISTANCE:
                 hunger_comp = i.get_component(Hunger)
                 hunger_comp.value += BUSH_FOOD_VALUE
                 if hp_comp is not None:
                     hp_comp.value += BUSH_HP_VALUE
-                self.entity_manager.add_component(closest_bush[0], DeadTag("съедения"))
+                self.entity_manager.add_command(self.entity_manager.add_component,
+                                                closest_bush.entity, DeadTag("съедения"))
+                bushes.remove(closest_bush)
 
 
 class HuntingSystem(BaseSystem):
+    __update_interval__ = 1.5
+    __reads__ = (Position, Strength, Health, Team, Priority, DeadTag)
+    # The grids of the teams are built on the first query in a step.
+    __writes__ = (TargetPosition, SpatialIndex)
 
     def __init__(self):
         self.filter = None
-        self.time = 0
+        self.filter2 = None
+        self.__spatial_index = None
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(Position, TargetPosition,
+        self.filter = self.entity_manager.create_filter(required=(Position, TargetPosition, Rigidbody,
                                                                   Strength, Health, Team),
                                                         additional=(Priority,),
-                                                        without=(DeadTag,))
+                                                        without=(DeadTag, GhostTag))
+        # Prey, with the ghosts of neighbouring shards.
+        self.filter2 = self.entity_manager.create_filter(required=(Position, Rigidbody, Strength, Health, Team),
+                                                         without=(DeadTag,))
+        self.__spatial_index = World.current_world.get_or_create_system(SpatialIndexSystem)
 
     def on_update(self, delta_time: float) -> None:
-        self.time += delta_time
-        if self.time < 1.5:
-            return
-        self.time = 0
         creatures = tuple(self.query(self.filter))
+        if not creatures:
+            return
+        index = self.__spatial_index
+        points = index.points
+        positions = []
+        health = []
+        strength = []
+        teams = []
+        numbers = dict()
+        for n, i in enumerate(self.query(self.filter2)):
+            x, y, _ = points[i]
+            positions.append(Vector(x, y))
+            health.append(i.get_component(Health).value)
+            strength.append(i.get_component(Strength).value)
+            teams.append(i.get_component(Team).value)
+            numbers[i] = n
+        first = numbers[creatures[0]]
+        fallback = positions[first]
+        # Hunters and prey are both where the step started, as the index holds them. A hunter searches only
+        # the grids of the other teams; every grid adds records in query order, so equally distant prey
+        # still resolves to the earliest creature.
+        grids = index.get_teams()
+
         for i in creatures:
             priority_comp = i.get_component(Priority)
             if priority_comp is not None and priority_comp.current != 'hunting':
                 continue
-            hp_comp = i.get_component(Health)
-
-            team = i.get_component(Team).value
-            pos_comp = i.get_component(Position)
-            target_comp = i.get_component(TargetPosition)
-            strength = i.get_component(Strength).value
-
-            closest_pos = creatures[0].get_component(Position).value
-
-            for j in creatures:
-                if j == i or team == j.get_component(Team).value:
+            n = numbers[i]
+            pos = positions[n]
+            hp = health[n]
+            hunter_strength = strength[n]
+            max_distance = (pos - fallback).len()
+
+            def is_prey(record) -> bool:
+                j = numbers.get(record, None)
+                return j is not None and health[j] / hunter_strength * hunter_strength * DAMAGE_MULTIPLIER \
+                    >= hp / strength[j] * DAMAGE_MULTIPLIER
+
+            closest = None
+            closest_distance = None
+            for team, grid in grids.items():
+                if team == teams[n] or not len(grid):
                     continue
-                pos = j.get_component(Position).value
-
-                if (pos_comp.value - pos).sqr_len() < (pos_comp.value - closest_pos).sqr_len() \
-                        and j.get_component(Health).value / strength * strength * DAMAGE_MULTIPLIER \
-                        >= hp_comp.value / j.get_component(Strength).value * DAMAGE_MULTIPLIER:
-                    closest_pos = pos
-            target_comp.value = closest_pos
+                record = grid.nearest(pos, is_prey, max_distance)
+                if record is None:
+                    continue
+                j = numbers[record]
+                dx = positions[j].x - pos.x
+                dy = positions[j].y - pos.y
+                distance = dx * dx + dy * dy
+                if closest is None or distance < closest_distance or distance == closest_distance and j < closest:
+                    closest = j
+                    closest_distance = distance
+            i.get_component(TargetPosition).value = Vector.clone(positions[closest if closest is not None else first])
 
 
 class PriorityControlSystem(BaseSystem):
+    __reads__ = (Hunger, Health, DeadTag)
+    __writes__ = (Priority, MoveSpeed)
 
     def __init__(self):
         self.filter = None
 
     def on_create(self) -> None:
         self.filter = self.entity_manager.create_filter(required=(Priority, Hunger, Health, MoveSpeed),
-                                                        without=(DeadTag,))
+                                                        without=(DeadTag, GhostTag))
 
     def on_update(self, delta_time: float) -> None:
         for i in self.query(self.filter):
@@ -310,49 +467,55 @@ class PriorityControlSystem(BaseSystem):
 
 class PositionLimitSystem(BaseSystem):
     __update_order__ = 100
+    __reads__ = ()
+    __writes__ = (Position,)
 
     def __init__(self):
         self.filter = None
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(Position,))
+        self.filter = self.entity_manager.create_filter(required=(Position,), without=(GhostTag,))
 
     def on_update(self, delta_time: float) -> None:
         for i in self.query(self.filter):
-            pos_comp = i.get_component(Position)
-            pos_comp.value = pos_comp.value.normalized() * min(pos_comp.value.len(), WORLD_SIZE)
+            clamp_length(i.get_component(Position).value, WORLD_SIZE)
+
+    def on_update_batch(self, delta_time: float) -> None:
+        for archetype in self.query(self.filter).archetypes:
+            if not archetype.records:
+                continue
+            clamp_lengths(archetype.get_column(Position, "value"), WORLD_SIZE)
 
 
 class CollisionSystem(BaseSystem):
     __update_order__ = -5
+    __reads__ = (Strength, SpatialIndex)
+    __writes__ = (Position, Rigidbody)
 
     def __init__(self):
         self.filter = None
-        self.simplification_value = 10
-        self.simp_offset = ceil(START_CREATURE_SIZE / self.simplification_value)
-        self.simp_offsets = tuple(Vector(x, y) * self.simplification_value
-                                  for x in range(-self.simp_offset, self.simp_offset + 1)
-                                  for y in range(-self.simp_offset, self.simp_offset + 1))
+        self.filter2 = None
+        self.__spatial_index = None
 
     def on_create(self) -> None:
         self.filter = self.entity_manager.create_filter(required=(Position, Rigidbody),
-                                                        additional=(Strength,))
+                                                        additional=(Strength,),
+                                                        without=(GhostTag,))
+        # Ghosts of neighbouring shards push the bodies of this one, but are not moved.
+        self.filter2 = self.entity_manager.create_filter(required=(Position, Rigidbody, GhostTag),
+                                                         additional=(Strength,))
+        self.__spatial_index = World.current_world.get_or_create_system(SpatialIndexSystem)
 
     def on_update(self, delta_time: float) -> None:
-        colliders = dict()
-        creatures = []
-        for i in self.query(self.filter):
-            rigidbody_comp = i.get_component(Rigidbody)
-            vel = rigidbody_comp.velocity
-            strength_comp = i.get_component(Strength)
-            strength = strength_comp.value if strength_comp is not None else 0
-
-            position = i.get_component(Position).value
-            simplified_pos = Vector(round(position.x) // self.simplification_value * self.simplification_value,
-                                    round(position.y) // self.simplification_value * self.simplification_value)
-            colliders[simplified_pos] = colliders.get(simplified_pos, [])
-            colliders[simplified_pos].append((i.entity, position, vel, strength))
-            creatures.append(i)
+        if self.entity_manager.get_entities().is_columnar():
+            # The pass only needs the columns, so it is vectorized in columnar worlds that are not batched too.
+            self.on_update_batch(delta_time)
+            return
+        creatures = tuple(self.query(self.filter))
+        if not creatures:
+            return
+        # Nothing has moved since the index was built at the start of the step.
+        grid = self.__spatial_index.creatures
 
         for i in creatures:
             rigidbody_comp = i.get_component(Rigidbody)
@@ -360,33 +523,100 @@ class CollisionSystem(BaseSystem):
             vel = rigidbody_comp.velocity
 
             position = i.get_component(Position).value
-            for key in map(lambda x: x + simplified_pos, self.simp_offsets):
-                res = colliders.get(key, None)
-                if res is None:
+            for j in grid.query_radius(position, 2 * radius):
+                if j is i:
                     continue
-                for ent, other_position, other_vel, other_strength in res:
-                    if ent == i.entity:
-                        continue
-                    diff = other_position - position
-                    if diff.sqr_len() > 4 * radius * radius:
-                        continue
-                    vel -= diff.normalized() * (PUSH_MULTIPLIER * other_strength)
-
-        for arr in colliders.values():
-            for pos, vel in map(lambda x: (x[1], x[2]), arr):
-                pos += vel
-                vel *= 1 - DAMPENING
-                if vel.sqr_len() < 0.1:
-                    vel *= 0
+                strength_comp = j.get_component(Strength)
+                other_strength = strength_comp.value if strength_comp is not None else 0
+                add_direction(vel, position, j.get_component(Position).value, -PUSH_MULTIPLIER * other_strength)
+
+        for i in creatures:
+            pos = i.get_component(Position).value
+            vel = i.get_component(Rigidbody).velocity
+            pos += vel
+            vel *= 1 - DAMPENING
+            if vel.sqr_len() < 0.1:
+                vel *= 0
+
+    def on_update_batch(self, delta_time: float) -> None:
+        archetypes = [i for i in self.query(self.filter).archetypes if i.records]
+        if not archetypes:
+            return
+        # Ghosts come after the own bodies and are left out when the columns are written back.
+        rows = archetypes + [i for i in self.query(self.filter2).archetypes if i.records]
+        pos = np.concatenate([i.get_column(Position, "value") for i in rows])
+        vel = np.concatenate([i.get_column(Rigidbody, "velocity") for i in rows])
+        radius = np.concatenate([i.get_column(Rigidbody, "radius") for i in rows])
+        strength = np.concatenate([i.get_column(Strength, "value") if Strength in i.types
+                                   else np.zeros(len(i.records)) for i in rows])
+
+        first, second = self.__find_pairs(pos, radius)
+        reach = 2 * radius[first]
+        close = sqr_distances(pos[first], pos[second]) <= reach * reach
+        first, second = first[close], second[close]
+        push = pos[second] - pos[first]
+        scale_to_lengths(push, PUSH_MULTIPLIER * strength[second])
+        # Applied one pair at a time in neighbour order, like the scalar pass.
+        np.subtract.at(vel[:, 0], first, push[:, 0])
+        np.subtract.at(vel[:, 1], first, push[:, 1])
+
+        pos += vel
+        vel *= 1 - DAMPENING
+        vel[vel[:, 0] * vel[:, 0] + vel[:, 1] * vel[:, 1] < 0.1] *= 0
+
+        start = 0
+        for archetype in archetypes:
+            end = start + len(archetype.records)
+            archetype.get_column(Position, "value")[:] = pos[start:end]
+            archetype.get_column(Rigidbody, "velocity")[:] = vel[start:end]
+            start = end
+
+    @staticmethod
+    def __find_pairs(pos, radius):
+        # Candidate pairs (i, j), i != j, from the cells around every body, sorted by i and then j.
+        cell_size = max(radius.max() * COLLISION_CELL_SCALE, 1)
+        cells = np.floor(pos / cell_size).astype(np.int64)
+        span = int(np.ceil(2 * radius.max() / cell_size))
+        cells -= cells.min(axis=0) - span
+        width = int(cells[:, 1].max()) + span + 1
+        keys = cells[:, 0] * width + cells[:, 1]
+        order = np.argsort(keys, kind="stable")
+        unique_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+        first = []
+        second = []
+        bodies = np.arange(len(pos))
+        for dx in range(-span, span + 1):
+            for dy in range(-span, span + 1):
+                neighbour_keys = keys + dx * width + dy
+                found = np.minimum(np.searchsorted(unique_keys, neighbour_keys), len(unique_keys) - 1)
+                hits = unique_keys[found] == neighbour_keys
+                found_counts = np.where(hits, counts[found], 0)
+                total = int(found_counts.sum())
+                if not total:
+                    continue
+                repeated = np.repeat(bodies, found_counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(found_counts) - found_counts, found_counts)
+                first.append(repeated)
+                second.append(order[np.repeat(starts[found], found_counts) + offsets])
+        first = np.concatenate(first)
+        second = np.concatenate(second)
+        other = first != second
+        first, second = first[other], second[other]
+        pair_order = np.lexsort((second, first))
+        return first[pair_order], second[pair_order]
 
 
 class EvolveSystem(BaseSystem):
+    __reads__ = ()
+    __writes__ = (Hunger, MoveSpeed, Strength, Health, SharedRandom)
 
     def __init__(self):
         self.filter = None
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(Hunger,), additional=(MoveSpeed, Strength, Health))
+        self.filter = self.entity_manager.create_filter(required=(Hunger,), additional=(MoveSpeed, Strength, Health),
+                                                        without=(GhostTag,))
 
     def on_update(self, delta_time: float) -> None:
         for i in self.query(self.filter):
@@ -405,20 +635,36 @@ class EvolveSystem(BaseSystem):
                 if stat_comp is not None:
                     stat_comp.value += (0.65 - random()) * 14
 
+    def on_update_batch(self, delta_time: float) -> None:
+        for archetype in self.query(self.filter).archetypes:
+            if not archetype.records:
+                continue
+            hunger = archetype.get_column(Hunger, "value")
+            evolving = np.flatnonzero(hunger >= EVOLVE_HUNGER_VALUE)
+            if not len(evolving):
+                continue
+            hunger[evolving] -= EVOLVE_HUNGER_COST
+            stats = [(stat_type, offset, scale) for stat_type, offset, scale in
+                     ((MoveSpeed, 0.75, 5), (Strength, 0.9, 6.5), (Health, 0.65, 14)) if stat_type in archetype.types]
+            # Draw in the same order as the scalar path: every stat of one creature, then the next creature.
+            rolls = np.array([random() for _ in range(len(evolving) * len(stats))]).reshape(len(evolving), len(stats))
+            for num, (stat_type, offset, scale) in enumerate(stats):
+                archetype.get_column(stat_type, "value")[evolving] += (offset - rolls[:, num]) * scale
+
 
 class MouseHoverInfoSystem(BaseSystem):
+    __render__ = True
 
     def __init__(self):
         self.__locked_entity = None
-        self.filter = None
+        self.__spatial_index = None
         self.__render_system = None
         self.__render_surface = None
         self.__font = None
 
     def on_create(self) -> None:
         from src.core.application import Application
-        self.filter = self.entity_manager.create_filter(required=(Position,),
-                                                        additional=(MoveSpeed, Hunger, Strength, Health, Priority))
+        self.__spatial_index = World.current_world.get_or_create_system(SpatialIndexSystem)
         self.__render_system = World.current_world.get_or_create_system(RenderSystem)
         self.__font = pygame.font.Font(None, 30)
         self.__render_surface = Application.get_render_surface()
@@ -428,40 +674,47 @@ class MouseHoverInfoSystem(BaseSystem):
         mouse_pos = Mouse.get_position()
         if Mouse.is_mouse_down():
             self.__locked_entity = None
-        for i in self.query(self.filter):
-            pos = i.get_component(Position).value
-            entity_pos = pos - self.__render_system.camera_position
-            if (entity_pos - mouse_pos).sqr_len() <= 65 or self.__locked_entity is not None:
-                if Mouse.is_mouse_down():
-                    self.__locked_entity = i.entity
-                if self.__locked_entity is not None and i.entity != self.__locked_entity:
-                    continue
-                text = []
-                comp = i.get_component(MoveSpeed)
-                text.append(f"Entity id: {i.entity.get_id()}")
-                rx, ry = "%.1f" % pos.x, "%.1f" % pos.y
-                text.append(f"Position: ({rx}, {ry})")
-                if comp is not None:
-                    text.append(f"Speed: {'%.2f' % comp.value}")
-                comp = i.get_component(Priority)
-                if comp is not None:
-                    text.append(f"Priority: {comp.current}")
-                comp = i.get_component(Hunger)
-                if comp is not None:
-                    text.append(f"Hunger: {'%.2f' % comp.value}")
-                comp = i.get_component(Strength)
-                if comp is not None:
-                    text.append(f"Strength: {'%.2f' % comp.value}")
-                comp = i.get_component(Health)
-                if comp is not None:
-                    text.append(f"Health: {'%.2f' % comp.value}")
-                line_wrap_dist = 20
-                pos = (entity_pos - Vector(50, line_wrap_dist * len(text) + 10)).to_tuple()
-                for line in text:
-                    render_line = self.__font.render(line, False, (255, 255, 255), (20, 20, 20))
-                    self.entity_manager.add_command(self.__render_line, render_line, pos)
-                    pos = (pos[0], pos[1] + line_wrap_dist)
-                break
+        if self.__locked_entity is not None and self.entity_manager.has_entity(self.__locked_entity.entity):
+            i = self.__locked_entity
+        else:
+            self.__locked_entity = None
+            world_pos = mouse_pos + self.__render_system.camera_position
+            i = self.__spatial_index.creatures.nearest(world_pos, max_distance=sqrt(65))
+            if i is None:
+                i = self.__spatial_index.get_food().nearest(world_pos)
+            # The index holds the records of the last step, some of them may have been killed since.
+            if i is None or not self.entity_manager.has_entity(i.entity) \
+                    or (i.get_component(Position).value - world_pos).sqr_len() >= 65:
+                return
+            if Mouse.is_mouse_down():
+                self.__locked_entity = i
+        pos = i.get_component(Position).value
+        entity_pos = pos - self.__render_system.camera_position
+        text = []
+        comp = i.get_component(MoveSpeed)
+        text.append(f"Entity id: {i.entity.get_id()}")
+        rx, ry = "%.1f" % pos.x, "%.1f" % pos.y
+        text.append(f"Position: ({rx}, {ry})")
+        if comp is not None:
+            text.append(f"Speed: {'%.2f' % comp.value}")
+        comp = i.get_component(Priority)
+        if comp is not None:
+            text.append(f"Priority: {comp.current}")
+        comp = i.get_component(Hunger)
+        if comp is not None:
+            text.append(f"Hunger: {'%.2f' % comp.value}")
+        comp = i.get_component(Strength)
+        if comp is not None:
+            text.append(f"Strength: {'%.2f' % comp.value}")
+        comp = i.get_component(Health)
+        if comp is not None:
+            text.append(f"Health: {'%.2f' % comp.value}")
+        line_wrap_dist = 20
+        pos = (entity_pos - Vector(50, line_wrap_dist * len(text) + 10)).to_tuple()
+        for line in text:
+            render_line = self.__font.render(line, False, (255, 255, 255), (20, 20, 20))
+            self.entity_manager.add_command(self.__render_line, render_line, pos)
+            pos = (pos[0], pos[1] + line_wrap_dist)
 
     def __render_line(self, line, pos) -> None:
         self.__render_surface.blit(line, pos)
@@ -469,6 +722,7 @@ class MouseHoverInfoSystem(BaseSystem):
 
 class DrawWorldBordersSystem(BaseSystem):
     __update_order__ = 101
+    __render__ = True
 
     def __init__(self):
         from src.simulation.utils import create_circle
@@ -487,50 +741,103 @@ class DrawWorldBordersSystem(BaseSystem):
 
 
 class DamageSystem(BaseSystem):
+    __update_interval__ = 0.5
+    __reads__ = (Strength, Team, Position, Priority, SpatialIndex)
+    __writes__ = (Health, Hunger, SharedRandom)
 
     def __init__(self):
         self.filter = None
-        self.time = 0
+        self.filter2 = None
+        self.__spatial_index = None
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(Health, Strength, Team, Position, Hunger))
+        self.filter = self.entity_manager.create_filter(required=(Health, Strength, Team, Position, Hunger,
+                                                                  Rigidbody),
+                                                        additional=(Priority,),
+                                                        without=(GhostTag,))
+        # Ghosts of neighbouring shards attack the creatures of this one, the damage they take is up to their owner.
+        self.filter2 = self.entity_manager.create_filter(required=(Health, Strength, Team, Position, Hunger,
+                                                                   Rigidbody, GhostTag),
+                                                         additional=(Priority,))
+        self.__spatial_index = World.current_world.get_or_create_system(SpatialIndexSystem)
 
     def on_update(self, delta_time: float) -> None:
-        self.time += delta_time
-        if self.time < 0.5:
-            return
-        self.time = 0
         creatures = []
+        teams = []
+        attacks = []
         for i in self.query(self.filter):
             hp_comp = i.get_component(Health)
             if hp_comp.value <= -10000:
                 res = choice(("укуса", "захвата", "царапины", "удара об тумбочку", "солнечного удара"))
-                self.entity_manager.add_component(i.entity, DeadTag(res))
+                self.entity_manager.add_command(self.entity_manager.add_component, i.entity, DeadTag(res))
             elif hp_comp.value <= 0:
-                self.entity_manager.add_component(i.entity, DeadTag("голода"))
+                self.entity_manager.add_command(self.entity_manager.add_component, i.entity, DeadTag("голода"))
             else:
                 strength = i.get_component(Strength).value
-                team = i.get_component(Team).value
-                pos = i.get_component(Position).value
-                creatures.append((i.entity, pos, hp_comp, strength, team, i.get_component(Hunger)))
-
-        atck_dist_sqr = ATTACK_DISTANCE * ATTACK_DISTANCE
-        for ent, pos, hp_comp, strength, team, hunger in creatures:
-            for ent2, pos2, hp_comp2, strength2, team2, hunger2 in creatures:
-                if ent == ent2:
-                    continue
-                if team2 != team and (pos - pos2).sqr_len() <= atck_dist_sqr:
-                    p_comp = self.entity_manager.get_component(ent, Priority)
-                    mult = 1 if p_comp is None or p_comp.current != "hunting" else strength
-                    hp_comp2.value -= strength * DAMAGE_MULTIPLIER * mult
-                    if hp_comp2.value <= 0:
-                        hp_comp2.value -= 10000
-                        hp_comp.value += KILL_TREATMENT
-                        hunger.value += MEAT_FOOD_VALUE
+                p_comp = i.get_component(Priority)
+                mult = 1 if p_comp is None or p_comp.current != "hunting" else strength
+                creatures.append(i)
+                teams.append(i.get_component(Team).value)
+                attacks.append(strength * DAMAGE_MULTIPLIER * mult)
+        owned = len(creatures)
+        for i in self.query(self.filter2):
+            if i.get_component(Health).value > 0:
+                strength = i.get_component(Strength).value
+                p_comp = i.get_component(Priority)
+                mult = 1 if p_comp is None or p_comp.current != "hunting" else strength
+                creatures.append(i)
+                teams.append(i.get_component(Team).value)
+                attacks.append(strength * DAMAGE_MULTIPLIER * mult)
+
+        # Every attack of the tick is computed from the state at its start and applied afterwards,
+        # so the outcome does not depend on the order creatures are visited in.
+        damage = [0.0] * len(creatures)
+        attackers = [[] for _ in creatures]
+        for n, targets in enumerate(self.find_targets(creatures, teams)):
+            for j in targets:
+                if j < owned:
+                    damage[j] += attacks[n]
+                    attackers[j].append(n)
+
+        kills = [0] * len(creatures)
+        for j, i in enumerate(creatures[:owned]):
+            if not attackers[j]:
+                continue
+            hp_comp = i.get_component(Health)
+            hp_comp.value -= damage[j]
+            if hp_comp.value <= 0:
+                hp_comp.value -= 10000
+                for n in attackers[j]:
+                    kills[n] += 1
+        for n, i in enumerate(creatures[:owned]):
+            if kills[n]:
+                i.get_component(Health).value += KILL_TREATMENT * kills[n]
+                i.get_component(Hunger).value += MEAT_FOOD_VALUE * kills[n]
+
+    def find_targets(self, creatures: List[ComponentDataArray], teams: List[int]) -> List[List[int]]:
+        # Numbers of the creatures of other teams within ATTACK_DISTANCE of every creature, in the order of the query.
+        # Both ends are where the step started, as the index holds them, so a creature is in reach of its targets
+        # exactly when they are in reach of it.
+        points = self.__spatial_index.points
+        grid = self.__spatial_index.creatures
+        numbers = {i: n for n, i in enumerate(creatures)}
+        result = []
+        for n, i in enumerate(creatures):
+            x, y, _ = points[i]
+            team = teams[n]
+            targets = []
+            for record in grid.query_radius(Vector(x, y), ATTACK_DISTANCE):
+                j = numbers.get(record, None)
+                if j is not None and j != n and teams[j] != team:
+                    targets.append(j)
+            result.append(targets)
+        return result
 
 
 class KillSystem(BaseSystem):
     __update_order__ = 200
+    __reads__ = (DeadTag, UserId, EntityName)
+    __writes__ = ()
 
     def __init__(self):
         self.__methods = None
@@ -539,12 +846,11 @@ class KillSystem(BaseSystem):
     def on_create(self) -> None:
         from src.vk_bot.commands import BotMethods
         self.__methods = BotMethods
-        self.filter = self.entity_manager.create_filter(required=(DeadTag,), additional=(UserId, EntityName))
+        self.filter = self.entity_manager.create_filter(required=(DeadTag,), additional=(UserId, EntityName),
+                                                        without=(GhostTag,))
 
     def on_update(self, delta_time: float) -> None:
-        to_kill = set()
-        for i in self.query(self.filter):
-            to_kill.add(i)
+        to_kill = list(self.query(self.filter))
 
         self.entity_manager.add_command(self.__kill, to_kill)
 
@@ -569,31 +875,43 @@ class KillSystem(BaseSystem):
 
 
 class LifeTimeSystem(BaseSystem):
+    __reads__ = (DeadTag,)
+    __writes__ = (LifeTime, SharedRandom)
 
     def __init__(self):
         self.filter = None
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(LifeTime,), without=(DeadTag,))
+        self.filter = self.entity_manager.create_filter(required=(LifeTime,), without=(DeadTag, GhostTag))
 
     def on_update(self, delta_time: float) -> None:
         for i in self.query(self.filter):
             comp = i.get_component(LifeTime)
             comp.value += delta_time
             if random() <= comp.value * comp.value / 900000000:
-                self.entity_manager.add_component(i.entity, DeadTag("тяжёлой жизни"))
+                self.entity_manager.add_command(self.entity_manager.add_component,
+                                                i.entity, DeadTag("тяжёлой жизни"))
 
+    def on_update_batch(self, delta_time: float) -> None:
+        for archetype in self.query(self.filter).archetypes:
+            if not archetype.records:
+                continue
+            life_time = archetype.get_column(LifeTime, "value")
+            life_time += delta_time
+            rolls = np.array([random() for _ in range(len(life_time))])
+            dying = [archetype.records[row] for row in np.flatnonzero(rolls <= life_time * life_time / 900000000)]
+            for i in dying:
+                self.entity_manager.add_command(self.entity_manager.add_component,
+                                                i.entity, DeadTag("тяжёлой жизни"))
 
-class BotCreationSystem(BaseSystem):
 
-    def __init__(self):
-        self.time = 0
+class BotCreationSystem(BaseSystem):
+    __update_interval__ = BOT_CREATE_DELAY
+    __reads__ = ()
+    __writes__ = ()
 
     def on_update(self, delta_time: float) -> None:
-        self.time += delta_time
-        if self.time >= BOT_CREATE_DELAY:
-            self.entity_manager.add_command(self.__create_command)
-            self.time = 0
+        self.entity_manager.add_command(self.__create_command)
 
     def __create_command(self) -> None:
         entity = self.entity_manager.create_entity()
@@ -603,14 +921,17 @@ class BotCreationSystem(BaseSystem):
 
 class RunAwaySystem(BaseSystem):
     __update_order__ = 50
+    __reads__ = (Priority, Position, Team)
+    __writes__ = (TargetPosition,)
 
     def __init__(self):
         self.filter = None
         self.filter2 = None
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(Priority, Position, TargetPosition, Team))
-        self.filter2 = self.entity_manager.create_filter(required=(Position, Team))
+        self.filter = self.entity_manager.create_filter(required=(Priority, Position, TargetPosition, Team),
+                                                        without=(GhostTag,))
+        self.filter2 = self.entity_manager.create_filter(required=(Position, Team), without=(GhostTag,))
 
     def on_update(self, delta_time: float) -> None:
         team_clusters = {team: [0, Vector(0, 0)] for team in range(len(TEAM_COLORS))}
@@ -630,34 +951,33 @@ class RunAwaySystem(BaseSystem):
 
 
 class ReproduceSystem(BaseSystem):
+    __update_interval__ = REPRODUCE_DELAY
 
     def __init__(self):
         self.filter = None
-        self.time = 0
+        self.max_creatures = MAX_CREATURES
 
     def on_create(self) -> None:
-        self.filter = self.entity_manager.create_filter(required=(Team, MoveSpeed, Strength, Health, Position))
+        self.filter = self.entity_manager.create_filter(required=(Team, MoveSpeed, Strength, Health, Position),
+                                                        without=(GhostTag,))
 
     def on_update(self, delta_time: float) -> None:
-        self.time += delta_time
-        if self.time >= REPRODUCE_DELAY:
-            count = 0
-            for i in self.query(self.filter):
-                count += 1
-                if random() > REPRODUCE_CHANCE:
-                    continue
-                if count >= MAX_CREATURES:
-                    break
-                count += 1
-                entity = self.entity_manager.create_entity()
-                create_named_creature(self.entity_manager, entity, "Bot" + str(entity.get_id()),
-                                      i.get_component(Team).value)
-                speed_comp = self.entity_manager.get_component(entity, MoveSpeed)
-                speed_comp.value = max(1.5, i.get_component(MoveSpeed).value * (0.5 - random()) * 5)
-                str_comp = self.entity_manager.get_component(entity, Strength)
-                str_comp.value = max(1, i.get_component(Strength).value * (0.5 - random()) * 4)
-                hp_comp = self.entity_manager.get_component(entity, Health)
-                hp_comp.value = max(200, i.get_component(Health).value * (0.5 - random()) * 13)
-                pos_comp = self.entity_manager.get_component(entity, Position)
-                pos_comp.value = Vector.clone(i.get_component(Position).value)
-            self.time = 0
+        count = 0
+        for i in self.query(self.filter):
+            count += 1
+            if random() > REPRODUCE_CHANCE:
+                continue
+            if count >= self.max_creatures:
+                break
+            count += 1
+            entity = self.entity_manager.create_entity()
+            create_named_creature(self.entity_manager, entity, "Bot" + str(entity.get_id()),
+                                  i.get_component(Team).value)
+            speed_comp = self.entity_manager.get_component(entity, MoveSpeed)
+            speed_comp.value = max(1.5, i.get_component(MoveSpeed).value * (0.5 - random()) * 5)
+            str_comp = self.entity_manager.get_component(entity, Strength)
+            str_comp.value = max(1, i.get_component(Strength).value * (0.5 - random()) * 4)
+            hp_comp = self.entity_manager.get_component(entity, Health)
+            hp_comp.value = max(200, i.get_component(Health).value * (0.5 - random()) * 13)
+            pos_comp = self.entity_manager.get_component(entity, Position)
+            pos_comp.value = Vector.clone(i.get_component(Position).value)
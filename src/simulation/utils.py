@@ -1,5 +1,6 @@
+from functools import partial
 from random import randint, random
-from pygame import Surface, draw, Color, font
+from pygame import Surface, draw, Color, font, sprite
 from .settings import *
 from src.ecs.entities import Entity
 from .components import *
@@ -49,8 +50,8 @@ def create_creature(entity_manager: EntityManager, entity: Entity, team: int = -
 
     team_comp = Team()
     team_comp.value = team if 0 <= team < len(TEAM_COLORS) else 0
-    render_comp.sprite = create_circle(START_CREATURE_SIZE, TEAM_COLORS[team_comp.value],
-                                       CREATURE_BORDER_COLOR, CREATURE_BORDER_WIDTH)
+    render_comp.set_factory(partial(create_circle, START_CREATURE_SIZE, TEAM_COLORS[team_comp.value],
+                                    CREATURE_BORDER_COLOR, CREATURE_BORDER_WIDTH))
 
     move_speed_comp = MoveSpeed()
     move_speed_comp.value = randint(3, 13)
@@ -94,8 +95,8 @@ def create_food(entity_manager: EntityManager, entity: Entity) -> None:
     pos_comp = Position()
     pos_comp.value = random_world_position()
     render_comp = RenderSprite()
-    render_comp.sprite = create_rect(START_FOOD_SIZE, START_FOOD_SIZE, START_FOOD_COLOR,
-                                     FOOD_BORDER_COLOR, FOOD_BORDER_WIDTH)
+    render_comp.set_factory(partial(create_rect, START_FOOD_SIZE, START_FOOD_SIZE, START_FOOD_COLOR,
+                                    FOOD_BORDER_COLOR, FOOD_BORDER_WIDTH))
     entity_manager.add_component(entity, pos_comp)
     entity_manager.add_component(entity, render_comp)
     entity_manager.add_component(entity, BushTag())
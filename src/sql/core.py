@@ -6,19 +6,36 @@ import sqlalchemy.ext.declarative as dec
 SqlAlchemyBase = dec.declarative_base()
 
 
+def set_sqlite_pragmas(connection, connection_record) -> None:
+    # WAL lets readers work during a save; with WAL, synchronous=NORMAL only syncs at checkpoints and still
+    # never corrupts the database, it may only lose the last transactions on a power loss.
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 class Factory:
     __slots__ = ()
     __factory = None
     __session = None
+    __engine = None
 
     @staticmethod
     def init(connection_string: str):
         if Factory.__factory is not None:
             return
         engine = sa.create_engine(connection_string, echo=False)
+        if engine.dialect.name == "sqlite":
+            sa.event.listen(engine, "connect", set_sqlite_pragmas)
+        Factory.__engine = engine
         Factory.__factory = orm.sessionmaker(bind=engine)
         SqlAlchemyBase.metadata.create_all(engine)
 
+    @staticmethod
+    def get_engine():
+        return Factory.__engine
+
     @staticmethod
     def get_or_create_session() -> Session:
         if Factory.__session is None:
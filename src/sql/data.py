@@ -1,27 +1,40 @@
 from src.ecs.world import World
 from src.ecs.component import BaseComponent
+from src.ecs.entities import Entity
 import src.simulation.__all_components
 from .core import Factory
 from .core import SqlAlchemyBase
+from src.simulation.settings import SAVE_DELAY
+import sqlalchemy as sa
+from sqlalchemy import inspect
 from datetime import datetime
+from threading import Lock, Thread
+from time import time
+from typing import Dict, List, Tuple, Type
 
 
 class EntryDeletionStack:
-    __to_delete: list = []
+    # Counts components removed since the last save. Their rows go away when the save rewrites the tables.
+    __count = 0
 
     @staticmethod
     def add(data: SqlAlchemyBase) -> None:
-        EntryDeletionStack.__to_delete.append(data)
+        EntryDeletionStack.__count += 1
 
     @staticmethod
-    def delete_all() -> None:
-        session = Factory.get_or_create_session()
-        for i in EntryDeletionStack.__to_delete:
-            try:
-                session.delete(i)
-            except:
-                pass
-        EntryDeletionStack.__to_delete.clear()
+    def get_count() -> int:
+        return EntryDeletionStack.__count
+
+    @staticmethod
+    def clear() -> None:
+        EntryDeletionStack.__count = 0
+
+
+class EntityEntry(SqlAlchemyBase):
+    # Generation of every entity id, so handles given out before a restart stay valid after it.
+    __tablename__ = "entity"
+    sql_id = sa.Column(sa.Integer, primary_key=True, name="id")
+    sql_generation = sa.Column(sa.Integer, name="generation")
 
 
 def create_entities_from_database() -> None:
@@ -29,6 +42,7 @@ def create_entities_from_database() -> None:
     manager = world.get_manager()
     entities = []
     session = Factory.get_or_create_session()
+    Entity.restore_generations({i.sql_id: i.sql_generation for i in session.query(EntityEntry)})
     for component_type in BaseComponent.__subclasses__():
         for component in session.query(component_type):
             while len(entities) <= component.sql_entity_id:
@@ -36,27 +50,124 @@ def create_entities_from_database() -> None:
             entity = entities[component.sql_entity_id]
             component.from_database(manager)
             manager.add_component(entity, component)
+    # Ids between the saved entities were free, they are released again.
+    for entity in entities:
+        if not manager.get_entities()[entity]:
+            manager.kill_entity(entity)
+    # Saving writes the tables directly, so the session must not flush the loaded components on its own.
+    # Closing also ends its read transaction, which would keep WAL checkpoints from shrinking the log.
+    session.close()
 
 
-def save_to_database() -> None:
-    session = Factory.get_or_create_session()
-    EntryDeletionStack.delete_all()
+ENTITY_ID_COLUMN = BaseComponent.sql_entity_id.name
+_columns: Dict[Type[BaseComponent], List[Tuple[str, str]]] = dict()
 
+
+def get_columns(component_type: Type[BaseComponent]) -> List[Tuple[str, str]]:
+    # (attribute, column name) of every mapped column but the entity id, e.g. ("sql_x", "x").
+    columns = _columns.get(component_type, None)
+    if columns is None:
+        columns = _columns[component_type] = [(prop.key, prop.columns[0].name)
+                                               for prop in inspect(component_type).column_attrs
+                                               if prop.key != "sql_entity_id"]
+    return columns
+
+
+def collect_rows() -> Dict[type, List[dict]]:
+    # Column values of every component. Must run on the main thread between frames, the rows are then a
+    # consistent copy of the world that any thread can write.
     world = World.default_world
     manager = world.get_manager()
     comp_types = BaseComponent.__subclasses__()
+    rows: Dict[type, List[dict]] = {component_type: [] for component_type in comp_types}
     comp_filter = manager.create_filter(required=(), additional=comp_types)
     for i in manager.get_entities().filter(comp_filter):
-        entity = i.entity
-        for component in i.components.values():
-            component.to_database()
-            component.sql_entity_id = entity.get_id()
+        entity_id = i.entity.get_id()
+        for component_type, component in i.components.items():
             try:
-                session.add(component)
+                component.to_database()
             except BaseException as e:
                 print(f"{component} can't be added to database. Reason: {e}")
+                continue
+            # The mapped values are read from the instance dictionary, past the ORM's attribute events.
+            values = component.__dict__
+            row = {name: values.get(key, None) for key, name in get_columns(component_type)}
+            row[ENTITY_ID_COLUMN] = entity_id
+            rows[component_type].append(row)
+    rows[EntityEntry] = [{"id": entity_id, "generation": generation}
+                         for entity_id, generation in enumerate(Entity.get_generations())]
+    # Removed components are gone from the tables with everything else.
+    EntryDeletionStack.clear()
+    return rows
+
+
+def write_rows(rows: Dict[type, List[dict]]) -> None:
+    # Every save replaces the tables with the collected rows: one transaction with a delete and an
+    # executemany insert per table. A failed write rolls back and leaves the previous save whole.
+    with Factory.get_engine().begin() as connection:
+        for component_type, table_rows in rows.items():
+            table = component_type.__table__
+            connection.execute(table.delete())
+            if table_rows:
+                connection.execute(table.insert(), table_rows)
+
+
+class AutoSave:
+    # Saves the world every SAVE_DELAY seconds without stopping the simulation: the rows are collected on
+    # the main thread, a background thread writes them.
+    __slots__ = ()
+    __lock = Lock()
+    __thread: Thread = None
+    __last_save = 0
+    # Number of the latest collected rows and of the latest written ones, so older rows never overwrite
+    # a newer save that got to the database first.
+    __collected = 0
+    __written = 0
+
+    @staticmethod
+    def update() -> None:
+        if Factory.get_engine() is None:
+            return
+        now = time()
+        if not AutoSave.__last_save:
+            AutoSave.__last_save = now
+            return
+        if now - AutoSave.__last_save < SAVE_DELAY or AutoSave.is_writing():
+            return
+        AutoSave.__last_save = now
+        save_to_database(wait=False)
+
+    @staticmethod
+    def is_writing() -> bool:
+        return AutoSave.__thread is not None and AutoSave.__thread.is_alive()
+
+    @staticmethod
+    def write(rows: Dict[type, List[dict]], wait: bool) -> None:
+        AutoSave.__collected += 1
+        if wait:
+            AutoSave.__write(rows, AutoSave.__collected)
+            return
+        AutoSave.__thread = Thread(target=AutoSave.__write, args=(rows, AutoSave.__collected),
+                                   name="AutoSave", daemon=True)
+        AutoSave.__thread.start()
+
+    @staticmethod
+    def __write(rows: Dict[type, List[dict]], number: int) -> None:
+        with AutoSave.__lock:
+            if number < AutoSave.__written:
+                return
+            try:
+                write_rows(rows)
+            except BaseException as e:
+                print(f"Saving failed, the previous save is kept. Reason: {e}")
+                return
+            AutoSave.__written = number
+        print("Saved", datetime.now())
+
 
-    print("Saved", datetime.now())
+def save_to_database(wait: bool = True) -> None:
+    # With wait=False the write happens on a background thread and the call returns at once.
+    AutoSave.write(collect_rows(), wait)
 
 
 def close() -> None:
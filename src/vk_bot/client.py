@@ -61,6 +61,8 @@ class Client:
         return text[0] if text else ""
 
     def __process_command(self, event: VkBotEvent) -> None:
+        from src.core.metrics import Metrics
+        Metrics.count_bot_command()
         name = self.__get_command(event).lower()
         if name == "help":
             self.__help_command(event)
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from random import randint
-from typing import Tuple
+from typing import List, Optional, Tuple
 import requests
 import json
 from vk_api import ApiError
@@ -12,6 +12,7 @@ class BotMethods:
     from vk_api import VkApi
     __slots__ = ("__api", "__group_id")
     __instance: "BotMethods" = None
+    __outbox: Optional[List[Tuple[str, str]]] = None
     __group_id: str
 
     def __init__(self, session: VkApi, group_id: str):
@@ -22,12 +23,20 @@ class BotMethods:
 
     @staticmethod
     def send_message(peer_id: str, message: str) -> None:
+        if BotMethods.__outbox is not None:
+            BotMethods.__outbox.append((peer_id, message))
+            return
         try:
             BotMethods.__instance.__api.messages.send(peer_id=peer_id,
                                                       message=message, random_id=BotMethods.random_id())
         except ApiError as e:
             print(f"Can't send message to {peer_id}. Reason: {e}.")
 
+    @staticmethod
+    def redirect_messages(outbox: Optional[List[Tuple[str, str]]]) -> None:
+        # Collects messages in the list instead of sending them, for processes without a bot session.
+        BotMethods.__outbox = outbox
+
     @staticmethod
     def random_id() -> str:
         return str(randint(-10000000, 10000000))
@@ -196,7 +205,7 @@ class CreateUserEntityCommand(BaseCommand):
             id_comp.peer_id = str(data["peer_id"])
             entity_manager.add_component(entity, id_comp)
 
-            methods.send_message(data["peer_id"], f"Существо создано. Его номер — {entity.get_id()}.")
+            methods.send_message(data["peer_id"], f"Существо создано. Его номер — {entity.get_handle()}.")
 
         entity_manager.add_command(buffered_command)
 
@@ -218,7 +227,7 @@ class ListCommand(BaseCommand):
             for i in entity_manager.get_entities().filter(data_filter):
                 try:
                     if i.get_component(UserId).value == str(user_id):
-                        message.append(f"{i.get_component(EntityName).value}, номер — {i.entity.get_id()}.")
+                        message.append(f"{i.get_component(EntityName).value}, номер — {i.entity.get_handle()}.")
                 except:
                     continue
             if not message:
@@ -248,7 +257,7 @@ class StatsCommand(BaseCommand):
             from src.ecs.entities import EntityNotFoundError
 
             try:
-                entity = entity_manager.get_entity(num)
+                entity = entity_manager.get_entity_by_handle(num)
                 id_comp = entity_manager.get_component(entity, UserId)
 
                 if id_comp.value != str(user_id):
@@ -298,8 +307,11 @@ class PhotoCommand(BaseCommand):
             from src.core.application import Application, WIDTH, HEIGHT
             from pygame.image import save
 
+            if Application.is_headless():
+                methods.send_message(peer_id, "Симуляция запущена без экрана, фото недоступно.")
+                return
             try:
-                entity = entity_manager.get_entity(num)
+                entity = entity_manager.get_entity_by_handle(num)
                 pos = entity_manager.get_component(entity, Position).value
                 if entity_manager.get_component(entity, UserId).value != str(user_id):
                     raise EntityNotFoundError()
@@ -340,6 +352,71 @@ class UnpauseCommand(BaseCommand):
             methods.broadcast_message("Симуляция возобновлена.")
 
 
+class FastForwardCommand(BaseCommand):
+    _name = "fast"
+    _description = "запускает симуляцию с максимальной скоростью"
+    _owner_only = True
+    _event_data = ("peer_id",)
+
+    def on_call(self, data: dict, args: dict, methods: BotMethods) -> None:
+        from src.core.application import Application
+        if Application.set_fast_forward(True):
+            methods.send_message(data["peer_id"], "Ускоренный режим включен.")
+
+
+class NormalSpeedCommand(BaseCommand):
+    _name = "normal"
+    _description = "возвращает обычную скорость симуляции"
+    _owner_only = True
+    _event_data = ("peer_id",)
+
+    def on_call(self, data: dict, args: dict, methods: BotMethods) -> None:
+        from src.core.application import Application
+        if Application.set_fast_forward(False):
+            methods.send_message(data["peer_id"], "Ускоренный режим выключен.")
+
+
+class SpeedCommand(BaseCommand):
+    _name = "speed"
+    _description = "показывает, сколько секунд симуляции проходит за секунду"
+    _event_data = ("peer_id",)
+
+    def on_call(self, data: dict, args: dict, methods: BotMethods) -> None:
+        from src.core.application import Application
+        methods.send_message(data["peer_id"],
+                             f"Скорость симуляции: {'%.1f' % Application.get_simulation_speed()} сек. за секунду.")
+
+
+class MetricsCommand(BaseCommand):
+    _name = "metrics"
+    _description = "показывает метрики производительности"
+    _owner_only = True
+    _event_data = ("peer_id",)
+
+    def on_call(self, data: dict, args: dict, methods: BotMethods) -> None:
+        from src.core.metrics import Metrics
+        snapshot = Metrics.get_snapshot()
+        if snapshot is None:
+            methods.send_message(data["peer_id"], "Метрики ещё не собраны.")
+            return
+
+        def times(series) -> str:
+            p50, p95, p99 = ("%.1f" % (i * 1000) for i in series.quantiles)
+            return f"p50 {p50}, p95 {p95}, p99 {p99}, max {'%.1f' % (series.max * 1000)} мс"
+
+        lines = [f"Кадр: {times(snapshot['frame'])}.",
+                 f"FPS: {int(snapshot['fps'])}, скорость: {'%.1f' % snapshot['speed']}.",
+                 f"Сущностей: {snapshot['entities']}, архетипов: {snapshot['archetypes']}.",
+                 f"Команд в очереди: {snapshot['commands_pending']}, "
+                 f"в последнем шаге: {snapshot['commands_flushed']}.",
+                 f"Ожидают удаления из базы: {snapshot['deletions_pending']}.",
+                 f"Команд бота: {snapshot['bot_commands']}.",
+                 "Самые долгие системы:"]
+        systems = sorted(snapshot["systems"].items(), key=lambda i: -i[1].quantiles[-1])[:5]
+        lines.extend(f"{name}: {times(series)}." for name, series in systems)
+        methods.send_message(data["peer_id"], "\n".join(lines))
+
+
 class BroadcastCommand(BaseCommand):
     _name = "broadcast"
     _description = "отправляет {сообщение} всем участникам сообщества"
@@ -376,7 +453,7 @@ class SetPriorityCommand(BaseCommand):
             from src.ecs.entities import EntityNotFoundError
 
             try:
-                entity = entity_manager.get_entity(num)
+                entity = entity_manager.get_entity_by_handle(num)
                 id_comp = entity_manager.get_component(entity, UserId)
 
                 if id_comp.value != str(user_id):
@@ -390,6 +467,7 @@ class SetPriorityCommand(BaseCommand):
                 else:
                     methods.send_message(user_id, "Ошибка ввода.")
                     return
+                World.default_world.edit_component(entity, p_comp)
 
                 methods.send_message(peer_id, "Сделано.")
             except:
@@ -411,9 +489,11 @@ class KillAllCommand(BaseCommand):
 
         def command():
             for i in entity_manager.get_entities().filter(data_filter):
-                entity_manager.add_component(i.entity, DeadTag("божественных сил"))
+                dead_tag = DeadTag("божественных сил")
+                entity_manager.add_component(i.entity, dead_tag)
+                World.current_world.edit_component(i.entity, dead_tag)
             methods.broadcast_message("Симуляция сброшена администратором.")
-            save_to_database()
+            save_to_database(wait=False)
         entity_manager.add_command(command)
 
 
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+from src.ecs import columns
+from benchmarks.simulation import RESULT_PREFIX
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_simulation(*flags: str) -> dict:
+    # Every mode runs in a fresh process, so entity ids and the random state start the same.
+    command = [sys.executable, "-m", "benchmarks.simulation", "--single", "300", "--bushes", "150",
+               "--steps", "300", "--warmup", "0", "--seed", "1", *flags]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, universal_newlines=True, cwd=ROOT,
+                            env=dict(os.environ, SDL_VIDEODRIVER="dummy")).stdout
+    for line in reversed(output.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"No result in the output of {' '.join(command)}.")
+
+
+@unittest.skipUnless(columns.is_available(), "NumPy is not installed")
+class BatchedModeTest(unittest.TestCase):
+    def test_same_state(self):
+        scalar = run_simulation()
+        for flag in ("--columnar", "--batched"):
+            with self.subTest(flag):
+                result = run_simulation(flag)
+                self.assertTrue(result["mode"][flag[2:]])
+                self.assertEqual(result["entities"], scalar["entities"])
+                self.assertEqual(result["state"], scalar["state"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import random
+import unittest
+import pygame
+from src.core.main_timer import Time
+from src.ecs.world import World
+
+
+class DamageTargetsTest(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+        self.world = World.default_world = World.current_world = World()
+
+    def tearDown(self):
+        World.default_world = World.current_world = None
+
+    def test_targets_are_mutual(self):
+        # Attacks of a tick are applied together, which is only fair if every attacker is also a target
+        # of its own target.
+        from src.simulation.systems import DamageSystem
+        from src.simulation.utils import create_named_creature, create_food, TEAM_COLORS
+
+        self.world.create_all_systems(render=False)
+        manager = self.world.get_manager()
+        random.seed(1)
+        for num in range(300):
+            create_named_creature(manager, manager.create_entity(), "Bot" + str(num), num % len(TEAM_COLORS))
+        for _ in range(150):
+            create_food(manager, manager.create_entity())
+
+        damage = self.world.get_system(DamageSystem)
+        find_targets = damage.find_targets
+        pairs = []
+
+        def checked_find_targets(creatures, teams):
+            result = find_targets(creatures, teams)
+            for n, targets in enumerate(result):
+                for j in targets:
+                    self.assertIn(n, result[j], f"{n} attacks {j}, but {j} does not reach {n}")
+            pairs.append(sum(map(len, result)))
+            return result
+
+        damage.find_targets = checked_find_targets
+        for _ in range(600):
+            self.world.step(Time.get_fixed_delta_time())
+        self.assertTrue(sum(pairs), "No creature came within reach of another")
+
+
+if __name__ == "__main__":
+    unittest.main()